@@ -0,0 +1,68 @@
+from __future__ import annotations
+
+import random
+import time
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+
+import neat
+import numpy as np
+
+from curriculum_full import run_full_batch
+from scenario_seeds import ScenarioSeeds
+from utils import setup_encoder
+
+if TYPE_CHECKING:
+    from encoder import Encoder
+
+
+class BatchEvaluator:
+    """
+    Evaluates the whole population in one batched rollout: every genome
+    plays num_samples episodes, and all of them advance together through
+    BatchMinerEnv, Encoder.forward_batch and CompiledPolicy. A genome's
+    fitness is the mean reward over its samples, as in eval_function_template.
+    With scenario_seeds, every genome plays that generation's common seeds
+    and genomes already scored on them are skipped. With profile, the
+    phases of the batched tick are timed into generation_timings.
+    """
+    def __init__(self,
+                 num_samples: int = 3,
+                 encoder: Optional[Encoder] = None,
+                 scenario_seeds: Optional[ScenarioSeeds] = None,
+                 profile: bool = False):
+        self.num_samples = num_samples
+        self.profile = profile
+        self.encoder = encoder
+        self.scenario_seeds = scenario_seeds
+        self.generation_timings: List[Dict[str, float]] = []
+
+    def evaluate(self, genomes: List[Tuple[int, neat.DefaultGenome]], config: neat.Config):
+        start = time.perf_counter()
+        if self.encoder is None:
+            self.encoder = setup_encoder()
+        common_seeds = self.scenario_seeds.next_generation() if self.scenario_seeds is not None else None
+        num_genomes = len(genomes)
+        genomes = [(genome_id, genome) for genome_id, genome in genomes
+                   if not ScenarioSeeds.already_evaluated(genome, common_seeds)]
+        num_samples = self.num_samples if common_seeds is None else len(common_seeds)
+        episode_genomes = [genome for _, genome in genomes for _ in range(num_samples)]
+        if common_seeds is None:
+            seeds = [random.getrandbits(32) for _ in episode_genomes]
+        else:
+            seeds = [seed for _ in genomes for seed in common_seeds]
+        timings = {"episodes": 0, "ticks": 0, "skipped": num_genomes - len(genomes)}
+        if episode_genomes:
+            rewards = np.asarray(run_full_batch(episode_genomes, config, seeds, self.encoder, timings, self.profile))
+            fitnesses = rewards.reshape(len(genomes), num_samples).mean(axis=1)
+            for (_, genome), fitness in zip(genomes, fitnesses):
+                genome.fitness = float(fitness)
+                ScenarioSeeds.mark_evaluated(genome, common_seeds)
+        timings["wall"] = time.perf_counter() - start
+        self.generation_timings.append(timings)
+        print("Evaluated {0} genomes x {1} samples in one batch in {2:.2f}s".format(
+            len(genomes), num_samples, timings["wall"]))
+        if timings["skipped"] > 0:
+            print("Skipped {0} genomes already scored on these seeds".format(timings["skipped"]))
+
+    def close(self):
+        pass
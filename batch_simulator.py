@@ -0,0 +1,198 @@
+import random
+from typing import List, Sequence, Tuple
+
+import numpy as np
+
+from features import (ASTEROID_DIM, MINERAL_DIM, SHIP_DIM, asteroid_features,
+                      mineral_features, ship_features)
+from miner_objects import (ASTEROID_MAX_RADIUS, ASTEROID_MAX_SPEED,
+                           ASTEROID_MIN_RADIUS, FUEL_PER_MINERAL, FUEL_PER_MOVE,
+                           HEIGHT, IDLE_PENALTY, MAX_EPISODE_TIME, MAX_FUEL,
+                           MAX_IDLE_TIME, MIN_MINERALS, MINERAL_MARGIN,
+                           MINERAL_RADIUS, MINERAL_REWARD, NUM_ASTEROIDS,
+                           NUM_MINERALS, SHIP_RADIUS, SHIP_SPEED,
+                           TERMINAL_PENALTY, WIDTH)
+
+
+class BatchMinerEnv:
+    """
+    Steps many headless run_full episodes in lockstep.
+
+    State is stored as structure-of-arrays: one row per episode, with the
+    asteroid and mineral columns padded to a fixed capacity and the number of
+    live objects kept in num_asteroids / num_minerals. Each episode owns a
+    random.Random seeded with its seed, and draws from it in the same order
+    as run_full draws from the global random module, so an episode seeded
+    with s reproduces run_full after random.seed(s) tick for tick.
+    """
+    _EPISODE_ARRAYS = ("ship_x", "ship_y", "ship_angle", "ship_fuel", "ship_minerals",
+                       "num_asteroids", "asteroid_x", "asteroid_y", "asteroid_speed_x",
+                       "asteroid_speed_y", "asteroid_radius",
+                       "num_minerals", "mineral_x", "mineral_y",
+                       "reward", "alive_time", "idle_time", "done")
+
+    def __init__(self,
+                 seeds: Sequence[int],
+                 num_asteroids: int = NUM_ASTEROIDS,
+                 num_minerals: int = NUM_MINERALS,
+                 move_asteroids: bool = False):
+        self.num_episodes = len(seeds)
+        self.mineral_capacity = num_minerals
+        # run_full only moves asteroids when it is drawing them
+        self.move_asteroids = move_asteroids
+        self.rngs: List[random.Random] = [random.Random(seed) for seed in seeds]
+
+        n = self.num_episodes
+        self.ship_x = np.full((n,), WIDTH // 2, dtype=np.float64)
+        self.ship_y = np.full((n,), HEIGHT // 2, dtype=np.float64)
+        self.ship_angle = np.zeros((n,), dtype=np.float64)
+        self.ship_fuel = np.full((n,), MAX_FUEL, dtype=np.float64)
+        self.ship_minerals = np.zeros((n,), dtype=np.int64)
+
+        self.num_asteroids = np.full((n,), num_asteroids, dtype=np.int64)
+        self.asteroid_x = np.zeros((n, num_asteroids), dtype=np.float64)
+        self.asteroid_y = np.zeros((n, num_asteroids), dtype=np.float64)
+        self.asteroid_speed_x = np.zeros((n, num_asteroids), dtype=np.float64)
+        self.asteroid_speed_y = np.zeros((n, num_asteroids), dtype=np.float64)
+        self.asteroid_radius = np.zeros((n, num_asteroids), dtype=np.float64)
+
+        self.num_minerals = np.zeros((n,), dtype=np.int64)
+        self.mineral_x = np.zeros((n, num_minerals), dtype=np.float64)
+        self.mineral_y = np.zeros((n, num_minerals), dtype=np.float64)
+
+        self.reward = np.zeros((n,), dtype=np.float64)
+        self.alive_time = np.zeros((n,), dtype=np.int64)
+        self.idle_time = np.zeros((n,), dtype=np.int64)
+        self.done = np.zeros((n,), dtype=bool)
+
+        # observe writes into the first num_episodes rows of these every tick
+        self.ship_data = np.zeros((n, SHIP_DIM), dtype=np.float32)
+        self.asteroids_data = np.zeros((n, num_asteroids, ASTEROID_DIM), dtype=np.float32)
+        self.minerals_data = np.zeros((n, num_minerals, MINERAL_DIM), dtype=np.float32)
+
+        for ei, rng in enumerate(self.rngs):
+            for ai in range(num_asteroids):
+                self._spawn_asteroid(ei, ai, rng)
+            self._respawn_minerals(ei, num_minerals)
+
+    def compact(self, keep: np.ndarray):
+        """ Drop the episodes whose keep entry is False, e.g. finished ones, from every buffer. """
+        keep_index = np.flatnonzero(keep)
+        for name in self._EPISODE_ARRAYS:
+            setattr(self, name, getattr(self, name)[keep_index])
+        self.rngs = [self.rngs[ei] for ei in keep_index]
+        self.num_episodes = len(keep_index)
+
+    def _spawn_asteroid(self, ei: int, ai: int, rng: random.Random):
+        # Same draws, in the same order, as Asteroid.__init__
+        self.asteroid_x[ei, ai] = rng.randint(0, WIDTH)
+        self.asteroid_y[ei, ai] = rng.randint(0, HEIGHT)
+        self.asteroid_radius[ei, ai] = rng.randint(ASTEROID_MIN_RADIUS, ASTEROID_MAX_RADIUS)
+        self.asteroid_speed_x[ei, ai] = rng.uniform(-ASTEROID_MAX_SPEED, ASTEROID_MAX_SPEED)
+        self.asteroid_speed_y[ei, ai] = rng.uniform(-ASTEROID_MAX_SPEED, ASTEROID_MAX_SPEED)
+
+    def _respawn_minerals(self, ei: int, target: int):
+        # Same draws, in the same order, as Mineral.__init__
+        rng = self.rngs[ei]
+        while self.num_minerals[ei] < target:
+            mi = self.num_minerals[ei]
+            self.mineral_x[ei, mi] = rng.randint(MINERAL_MARGIN, WIDTH - MINERAL_MARGIN)
+            self.mineral_y[ei, mi] = rng.randint(MINERAL_MARGIN, HEIGHT - MINERAL_MARGIN)
+            self.num_minerals[ei] += 1
+
+    def observe(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Encoder inputs for every episode, as padded float32 arrays
+        ship (n, SHIP_DIM), asteroids (n, max_asteroids, ASTEROID_DIM) and
+        minerals (n, max_minerals, MINERAL_DIM). Rows past num_asteroids /
+        num_minerals are padding. The arrays are views of buffers that the
+        next observe overwrites, ready for torch.from_numpy without a copy.
+        """
+        n = self.num_episodes
+        ship_data = ship_features(self.ship_x, self.ship_y, self.ship_fuel, self.ship_angle, out=self.ship_data[:n])
+        asteroids_data = asteroid_features(self.asteroid_x, self.asteroid_y,
+                                           self.asteroid_speed_x, self.asteroid_speed_y,
+                                           self.asteroid_radius, out=self.asteroids_data[:n])
+        minerals_data = mineral_features(self.mineral_x, self.mineral_y, out=self.minerals_data[:n])
+        return ship_data, asteroids_data, minerals_data
+
+    def step(self, actions: np.ndarray) -> np.ndarray:
+        """
+        Advance every running episode by one tick using the policy outputs
+        actions (n, 2), mirroring one iteration of run_full's loop.
+        Finished episodes are left untouched. Returns the done mask.
+        """
+        live = np.flatnonzero(~self.done)
+        if len(live) == 0:
+            return self.done
+        actions = np.asarray(actions, dtype=np.float64)[live]
+        self.alive_time[live] += 1
+
+        # apply_action: turn, thrust, move
+        angle = self.ship_angle[live] + (actions[:, 0] * 2 - 1) * 0.1
+        self.ship_angle[live] = angle
+        thrust = actions[:, 1] > 0.5
+        dx = np.where(thrust, SHIP_SPEED * np.cos(angle), 0.)
+        dy = np.where(thrust, SHIP_SPEED * np.sin(angle), 0.)
+        old_x, old_y = self.ship_x[live], self.ship_y[live]
+        fuel = self.ship_fuel[live]
+        has_fuel = fuel > 0
+        x = np.where(has_fuel, np.mod(old_x + dx, WIDTH), old_x)
+        y = np.where(has_fuel, np.mod(old_y + dy, HEIGHT), old_y)
+        fuel = np.where(has_fuel, fuel - FUEL_PER_MOVE, fuel)
+
+        # Spaceship.mine
+        num_mined = self._mine(live, x, y)
+        for k in range(num_mined.max(initial=0)):
+            fuel = np.where(num_mined > k, np.minimum(MAX_FUEL, fuel + FUEL_PER_MINERAL), fuel)
+        self.ship_x[live], self.ship_y[live], self.ship_fuel[live] = x, y, fuel
+        self.ship_minerals[live] += num_mined
+
+        # Idle penalty and mining reward
+        reward = self.reward[live]
+        idle = (old_x == x) & (old_y == y)
+        reward = np.where(idle, reward - IDLE_PENALTY, reward)
+        self.idle_time[live] = np.where(idle, self.idle_time[live] + 1, 0)
+        reward += num_mined * MINERAL_REWARD
+
+        for ei in live[self.num_minerals[live] <= MIN_MINERALS]:
+            self._respawn_minerals(ei, self.mineral_capacity)
+
+        if self.move_asteroids:
+            self.asteroid_x[live] = np.mod(self.asteroid_x[live] + self.asteroid_speed_x[live], WIDTH)
+            self.asteroid_y[live] = np.mod(self.asteroid_y[live] + self.asteroid_speed_y[live], HEIGHT)
+
+        # Termination conditions, only the closest asteroid is tested
+        asteroid_collision = self._closest_asteroid_collision(live, x, y)
+        too_idle = self.idle_time[live] >= MAX_IDLE_TIME
+        reward = np.where(too_idle | asteroid_collision, reward - TERMINAL_PENALTY, reward)
+        out_of_fuel = fuel <= 0
+        self.reward[live] = reward
+        self.done[live] = too_idle | asteroid_collision | out_of_fuel | (self.alive_time[live] >= MAX_EPISODE_TIME)
+        return self.done
+
+    def _mine(self, live: np.ndarray, x: np.ndarray, y: np.ndarray) -> np.ndarray:
+        mineral_x, mineral_y = self.mineral_x[live], self.mineral_y[live]
+        valid = np.arange(self.mineral_capacity)[None, :] < self.num_minerals[live, None]
+        dist = np.hypot(x[:, None] - mineral_x, y[:, None] - mineral_y)
+        mined = valid & (dist < SHIP_RADIUS + MINERAL_RADIUS)
+        num_mined = mined.sum(axis=1)
+        if num_mined.any():
+            # Drop mined minerals while keeping the list order of the survivors
+            keep = valid & ~mined
+            order = np.argsort(~keep, axis=1, kind="stable")
+            self.mineral_x[live] = np.take_along_axis(mineral_x, order, axis=1)
+            self.mineral_y[live] = np.take_along_axis(mineral_y, order, axis=1)
+            self.num_minerals[live] = keep.sum(axis=1)
+        return num_mined
+
+    def _closest_asteroid_collision(self, live: np.ndarray, x: np.ndarray, y: np.ndarray) -> np.ndarray:
+        if self.asteroid_x.shape[1] == 0:
+            return np.zeros(len(live), dtype=bool)
+        valid = np.arange(self.asteroid_x.shape[1])[None, :] < self.num_asteroids[live, None]
+        dist = np.hypot(x[:, None] - self.asteroid_x[live], y[:, None] - self.asteroid_y[live])
+        dist = np.where(valid, dist, np.inf)
+        closest = np.argmin(dist, axis=1)[:, None]
+        closest_dist = np.take_along_axis(dist, closest, axis=1)[:, 0]
+        closest_radius = np.take_along_axis(self.asteroid_radius[live], closest, axis=1)[:, 0]
+        return closest_dist < SHIP_RADIUS + closest_radius
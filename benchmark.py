@@ -0,0 +1,307 @@
+"""
+Throughput benchmarks of the simulation, the encoder, the policy, the ray
+caster, encoder training and a whole NEAT generation.
+
+Every scenario runs with fixed seeds and the saved best genome, and
+returns a dict of metrics: names ending in "per_second" are better when
+higher, the others are seconds and better when lower. Timed loops report
+the best of several repeats, which is the least noisy estimate on a busy
+machine. run_benchmarks writes the results to a JSON file, and
+compare_results lists the metrics that got worse than a stored baseline
+by more than a tolerance, so a slower build is caught before it trains.
+"""
+import json
+import os
+import pathlib
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import neat
+import numpy as np
+
+from checkpoint_writer import load_checkpoint
+from compiled_policy import CompiledPolicy, compile_policy
+from curriculum_full import run_full
+from miner_objects import HEIGHT, WIDTH
+
+SEED = 0
+BEST_GENOME_PATH = pathlib.Path("checkpoints")/"full"/"best_genome"
+DATASET_DIR = pathlib.Path("datasets")
+
+
+def best_of(function: Callable[[], object], repeats: int = 5, number: int = 1) -> float:
+    """ Fewest seconds per call of function over repeats runs of number calls. """
+    function()
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        best = min(best, (time.perf_counter() - start) / number)
+    return best
+
+
+def higher_is_better(metric: str) -> bool:
+    return metric.endswith("per_second")
+
+
+def _observations(num_scenes: int, seed: int):
+    """ The first padded observation of num_scenes seeded episodes, as BatchMinerEnv.observe returns it. """
+    from batch_simulator import BatchMinerEnv
+
+    rng = random.Random(seed)
+    env = BatchMinerEnv([rng.getrandbits(32) for _ in range(num_scenes)])
+    return env.observe() + (env.num_asteroids.copy(), env.num_minerals.copy())
+
+
+def bench_tick_loop(config: neat.Config, genome: neat.DefaultGenome, num_episodes: int = 3) -> Dict[str, float]:
+    """ Headless run_full episodes of the best genome with the torch encoder. """
+    from utils import setup_encoder
+
+    encoder = setup_encoder()
+    seeds = [SEED + i for i in range(num_episodes)]
+    best = float("inf")
+    ticks = 0
+    for _ in range(3):
+        timings: Dict[str, float] = {}
+        for seed in seeds:
+            run_full(genome, config, encoder=encoder, timings=timings, seed=seed)
+        if timings["simulation"] < best:
+            best, ticks = timings["simulation"], timings["ticks"]
+    return {"ticks_per_second": ticks / best,
+            "episode_seconds": best / num_episodes}
+
+
+def bench_encoder(batch_size: int = 64) -> Dict[str, float]:
+    """ Encoder.forward one scene at a time against Encoder.forward_batch on batch_size scenes. """
+    import torch
+    from utils import setup_encoder
+
+    torch.set_num_threads(1)
+    encoder = setup_encoder()
+    encoder.eval()
+    ship_data, asteroids_data, minerals_data, num_asteroids, num_minerals = _observations(batch_size, SEED)
+    scenes = [(torch.from_numpy(ship_data[i]),
+               torch.from_numpy(asteroids_data[i, :num_asteroids[i]]),
+               torch.from_numpy(minerals_data[i, :num_minerals[i]])) for i in range(batch_size)]
+    batch = tuple(torch.from_numpy(array) for array in (ship_data, asteroids_data, minerals_data,
+                                                        num_asteroids, num_minerals))
+
+    def forward_scenes():
+        for scene in scenes:
+            encoder(*scene)
+
+    with torch.no_grad():
+        single = best_of(forward_scenes)
+        batched = best_of(lambda: encoder.forward_batch(*batch), number=10)
+    return {"batch_1_scenes_per_second": batch_size / single,
+            "batch_{0}_scenes_per_second".format(batch_size): batch_size / batched}
+
+
+def bench_policy(config: neat.Config, genome: neat.DefaultGenome, batch_size: int = 64) -> Dict[str, float]:
+    """ neat.nn.FeedForwardNetwork.activate against CompiledPolicy, one input and a batch of them. """
+    inputs = np.random.default_rng(SEED).standard_normal((batch_size, config.genome_config.num_inputs))
+    network = neat.nn.FeedForwardNetwork.create(genome, config)
+    policy = compile_policy(genome, config)
+    batch_policy = CompiledPolicy([genome], config)
+    rows = inputs.tolist()
+
+    def activate_network():
+        for row in rows:
+            network.activate(row)
+
+    def activate_compiled():
+        for row in inputs:
+            policy.activate(row)
+
+    return {"feed_forward_per_second": batch_size / best_of(activate_network, number=10),
+            "compiled_per_second": batch_size / best_of(activate_compiled, number=10),
+            "compiled_batch_per_second": batch_size / best_of(lambda: batch_policy.activate(inputs), number=10)}
+
+
+def bench_raycast(num_rays: int = 16, num_objects: int = 13, num_casts: int = 256) -> Dict[str, float]:
+    """ cast_rays_nb from random ship poses among num_objects random asteroids and minerals. """
+    from raycast import cast_rays_nb
+
+    rng = np.random.default_rng(SEED)
+    object_coords = rng.uniform((0, 0), (WIDTH, HEIGHT), (num_objects, 2))
+    obj_radius = rng.uniform(5, 40, num_objects)
+    obj_flags = rng.choice((-1., 1.), num_objects)
+    poses = rng.uniform((0, 0, 0), (WIDTH, HEIGHT, 2*np.pi), (num_casts, 3))
+    out = np.empty((num_rays*2,), dtype=np.float64)
+    max_length = float(np.hypot(WIDTH, HEIGHT))
+
+    def cast_all():
+        for ship_x, ship_y, ship_angle in poses:
+            cast_rays_nb(ship_x, ship_y, ship_angle, num_rays, object_coords, obj_radius, obj_flags, max_length, out)
+
+    return {"casts_per_second": num_casts / best_of(cast_all)}
+
+
+def bench_dataset(dataset_dir: pathlib.Path = DATASET_DIR, batch_size: int = 32) -> Dict[str, float]:
+    """
+    MinerDataset load time and one AutoEncoder training epoch over it.
+    The dataset is converted in a temporary copy, so dataset_dir is left as it is.
+    """
+    import torch
+    from torch.utils.data import DataLoader
+    from encoder import AutoEncoder
+    from episode_store import convert_json_dataset
+    from train_encoder import MinerDataset, collate_fn, masked_mse
+
+    torch.set_num_threads(1)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        copy_dir = pathlib.Path(tmp_dir)/"datasets"
+        shutil.copytree(dataset_dir, copy_dir)
+        convert_json_dataset(copy_dir)
+        load_seconds = best_of(lambda: MinerDataset(copy_dir), repeats=3)
+        dataset = MinerDataset(copy_dir)
+
+    torch.manual_seed(SEED)
+    auto_encoder = AutoEncoder()
+    optimizer = torch.optim.Adam(auto_encoder.parameters(), lr=3e-4)
+    dataloader = DataLoader(dataset, batch_size=batch_size, shuffle=True, collate_fn=collate_fn,
+                            generator=torch.Generator().manual_seed(SEED))
+    start = time.perf_counter()
+    for ship_data, asteroids_data, minerals_data, num_asteroids, num_minerals in dataloader:
+        preds = auto_encoder.forward_batch(ship_data, asteroids_data, minerals_data, num_asteroids, num_minerals)
+        loss = masked_mse(preds, (ship_data, asteroids_data, minerals_data), num_asteroids, num_minerals)
+        optimizer.zero_grad()
+        loss.backward()
+        optimizer.step()
+    epoch_seconds = time.perf_counter() - start
+    return {"load_seconds": load_seconds,
+            "epoch_seconds": epoch_seconds,
+            "epoch_scenes_per_second": len(dataset) / epoch_seconds}
+
+
+def bench_generation(config: neat.Config, evaluator: str = "parallel", num_generations: int = 2) -> Dict[str, float]:
+    """
+    num_generations NEAT generations from a seeded population on common
+    scenario seeds, with the "parallel" PersistentEvaluator or the "batch"
+    BatchEvaluator. The last generation is reported, so worker start-up
+    and first-call compilation stay out of the numbers.
+    """
+    from batch_evaluator import BatchEvaluator
+    from metrics import throughput
+    from scenario_seeds import ScenarioSeeds
+    from worker_pool import PersistentEvaluator
+
+    random.seed(SEED)
+    population = neat.Population(config)
+    scenario_seeds = ScenarioSeeds(3, SEED, 0)
+    if evaluator == "batch":
+        generation_evaluator = BatchEvaluator(3, scenario_seeds=scenario_seeds)
+    else:
+        generation_evaluator = PersistentEvaluator(os.cpu_count() or 1, run_full, 3, scenario_seeds=scenario_seeds)
+    try:
+        population.run(generation_evaluator.evaluate, num_generations)
+    finally:
+        generation_evaluator.close()
+    timings = generation_evaluator.generation_timings[-1]
+    rates = throughput(timings)
+    return {"generation_seconds": timings["wall"],
+            "episodes_per_second": rates["Episodes per Second"],
+            "ticks_per_second": rates["Ticks per Second"]}
+
+
+def run_benchmarks(config: neat.Config,
+                   genome_path: pathlib.Path = BEST_GENOME_PATH,
+                   scenarios: Optional[Sequence[str]] = None) -> dict:
+    """ Run the named scenarios, all of them by default, and return the results with the machine they ran on. """
+    genome = load_checkpoint(genome_path)
+    benchmarks: Dict[str, Callable[[], Dict[str, float]]] = {
+        "tick_loop": lambda: bench_tick_loop(config, genome),
+        "encoder": bench_encoder,
+        "policy": lambda: bench_policy(config, genome),
+        "raycast": bench_raycast,
+        "dataset": bench_dataset,
+        "generation_parallel": lambda: bench_generation(config, "parallel"),
+        "generation_batch": lambda: bench_generation(config, "batch"),
+    }
+    results = {}
+    for name in scenarios or benchmarks:
+        print("Running {0}".format(name))
+        start = time.perf_counter()
+        results[name] = benchmarks[name]()
+        print("{0} done in {1:.1f}s: {2}".format(name, time.perf_counter() - start, results[name]))
+    return {"machine": machine_info(), "seed": SEED, "results": results}
+
+
+def machine_info() -> Dict[str, object]:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = ""
+    return {"python": platform.python_version(),
+            "platform": platform.platform(),
+            "processor": platform.processor(),
+            "cpu_count": os.cpu_count(),
+            "commit": commit,
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S")}
+
+
+def compare_results(results: dict, baseline: dict, tolerance: float = 0.1) -> List[Tuple[str, str, float, float, float]]:
+    """
+    (scenario, metric, baseline value, value, relative change) of every
+    metric that got worse than baseline by more than tolerance. Metrics
+    missing from either side are not compared.
+    """
+    regressions = []
+    for scenario, metrics in results["results"].items():
+        baseline_metrics = baseline["results"].get(scenario, {})
+        for metric, value in metrics.items():
+            if metric not in baseline_metrics or baseline_metrics[metric] == 0:
+                continue
+            change = (value - baseline_metrics[metric]) / baseline_metrics[metric]
+            worse = -change if higher_is_better(metric) else change
+            if worse > tolerance:
+                regressions.append((scenario, metric, baseline_metrics[metric], value, change))
+    return regressions
+
+
+def format_comparison(results: dict, baseline: dict) -> str:
+    lines = ["{0:<20} {1:<32} {2:>12} {3:>12} {4:>8}".format("scenario", "metric", "baseline", "current", "change")]
+    for scenario, metrics in results["results"].items():
+        for metric, value in metrics.items():
+            base = baseline["results"].get(scenario, {}).get(metric)
+            if base is None:
+                lines.append("{0:<20} {1:<32} {2:>12} {3:>12.4g} {4:>8}".format(scenario, metric, "-", value, "-"))
+            else:
+                change = (value - base) / base if base else 0.
+                lines.append("{0:<20} {1:<32} {2:>12.4g} {3:>12.4g} {4:>+8.1%}".format(scenario, metric, base, value, change))
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    local_dir = os.path.dirname(__file__)
+    config = neat.Config(neat.DefaultGenome, neat.DefaultReproduction,
+                         neat.DefaultSpeciesSet, neat.DefaultStagnation,
+                         os.path.join(local_dir, "neat_config.txt"))
+    # None runs every scenario
+    scenarios = None
+    results_path = pathlib.Path("benchmark_results.json")
+    baseline_path = pathlib.Path("benchmark_baseline.json")
+    tolerance = 0.1
+
+    results = run_benchmarks(config, scenarios=scenarios)
+    with open(results_path, "w") as f:
+        json.dump(results, f, indent=2)
+    if not baseline_path.is_file():
+        # The first run on a machine becomes its baseline
+        shutil.copyfile(results_path, baseline_path)
+        print("No baseline yet, saved these results as {0}".format(baseline_path))
+        sys.exit(0)
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    print(format_comparison(results, baseline))
+    regressions = compare_results(results, baseline, tolerance)
+    for scenario, metric, base, value, change in regressions:
+        print("REGRESSION {0}/{1}: {2:.4g} -> {3:.4g} ({4:+.1%})".format(scenario, metric, base, value, change))
+    sys.exit(1 if regressions else 0)
@@ -0,0 +1,167 @@
+"""
+Background checkpoint writing for the reporters.
+
+CheckpointWriter.save pickles the object on the calling thread, which
+snapshots it before the next generation mutates it, and leaves compression
+and disk I/O to a writer thread. Every file is written to a temporary name
+and moved into place with os.replace, so readers never see a half-written
+checkpoint. load_checkpoint reads any codec, including the gzip files
+written before the codec became configurable.
+"""
+import atexit
+import glob
+import gzip
+import lzma
+import os
+import pathlib
+import pickle
+import queue
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# Leading bytes of each codec's output, used by load_checkpoint
+_GZIP_MAGIC = b"\x1f\x8b"
+_LZMA_MAGIC = b"\xfd7zXZ\x00"
+_ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+
+def _zstd_compress(data: bytes, level: int) -> bytes:
+    # zstandard is optional, only needed for codec = "zstd"
+    import zstandard
+    return zstandard.ZstdCompressor(level=level).compress(data)
+
+
+def _zstd_decompress(data: bytes) -> bytes:
+    import zstandard
+    return zstandard.ZstdDecompressor().decompress(data)
+
+
+# codec -> (compress(data, level), default level)
+CODECS: Dict[str, Tuple[Callable[[bytes, int], bytes], int]] = {
+    "none": (lambda data, level: data, 0),
+    "gzip": (lambda data, level: gzip.compress(data, compresslevel=level), 1),
+    "lzma": (lambda data, level: lzma.compress(data, preset=level), 0),
+    "zstd": (_zstd_compress, 3),
+}
+
+
+def load_checkpoint(path: os.PathLike) -> Any:
+    """ Unpickle a checkpoint written by CheckpointWriter with any codec. """
+    with open(path, "rb") as f:
+        data = f.read()
+    if data.startswith(_GZIP_MAGIC):
+        data = gzip.decompress(data)
+    elif data.startswith(_LZMA_MAGIC):
+        data = lzma.decompress(data)
+    elif data.startswith(_ZSTD_MAGIC):
+        data = _zstd_decompress(data)
+    return pickle.loads(data)
+
+
+class CheckpointWriter:
+    """
+    Writes pickled checkpoints to directory from a background thread.
+
+    save(name, obj, generation) always replaces directory/name. With
+    history > 0, it also keeps a copy as name-<generation>, and only the
+    newest history copies of each name are kept, counting the copies left in
+    directory by earlier runs, which are older than any written by this
+    one. codec is one of CODECS.
+    level defaults to a fast setting of the codec.
+    """
+    def __init__(self,
+                 directory: pathlib.Path,
+                 codec: str = "gzip",
+                 level: Optional[int] = None,
+                 history: int = 0):
+        if codec not in CODECS:
+            raise ValueError("Unknown checkpoint codec: {0}".format(codec))
+        self.codec = codec
+        self.directory = directory
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.compress, default_level = CODECS[codec]
+        self.level = default_level if level is None else level
+        self._level = level
+        self.history = history
+        self._history_files: Dict[str, List[pathlib.Path]] = {}
+        self._error: Optional[BaseException] = None
+        self._jobs: "queue.Queue[Optional[Tuple[str, bytes, Optional[int]]]]" = queue.Queue()
+        self._thread = threading.Thread(target=self._write_jobs, name="CheckpointWriter", daemon=True)
+        self._thread.start()
+        # Let queued checkpoints reach the disk when the run ends
+        atexit.register(self.close)
+
+    # The reporters holding a writer are pickled along with the species set
+    # they report to, so a writer pickles as its settings and starts afresh
+    def __getstate__(self) -> dict:
+        return {"directory": self.directory, "codec": self.codec, "level": self._level, "history": self.history}
+
+    def __setstate__(self, state: dict):
+        self.__init__(**state)
+
+    def save(self, name: str, obj: Any, generation: Optional[int] = None):
+        if self._error is not None:
+            raise RuntimeError("Writing checkpoints to {0} failed".format(self.directory)) from self._error
+        self._jobs.put((name, pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL), generation))
+
+    def _write_jobs(self):
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                break
+            name, data, generation = job
+            try:
+                data = self.compress(data, self.level)
+                self._write_file(self.directory/name, data)
+                if self.history > 0 and generation is not None:
+                    self._write_history(name, data, generation)
+            except BaseException as error:
+                self._error = error
+            finally:
+                self._jobs.task_done()
+
+    def _write_history(self, name: str, data: bytes, generation: int):
+        path = self.directory/"{0}-{1}".format(name, generation)
+        self._write_file(path, data)
+        if name not in self._history_files:
+            self._history_files[name] = self._existing_history(name)
+        files = self._history_files[name]
+        if path in files:
+            files.remove(path)
+        files.append(path)
+        while len(files) > self.history:
+            files.pop(0).unlink(missing_ok=True)
+
+    def _existing_history(self, name: str) -> List[pathlib.Path]:
+        """ The name-<generation> files already in directory, oldest generation first. """
+        files = []
+        for path in self.directory.glob(glob.escape(name) + "-*"):
+            generation = path.name[len(name) + 1:]
+            # Skips .tmp files and names that only share the prefix
+            if generation.isdigit():
+                files.append((int(generation), path))
+        return [path for generation, path in sorted(files)]
+
+    @staticmethod
+    def _write_file(path: pathlib.Path, data: bytes):
+        tmp_path = path.with_name(path.name + ".tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def flush(self):
+        """ Wait until every checkpoint saved so far is on disk. """
+        self._jobs.join()
+        if self._error is not None:
+            raise RuntimeError("Writing checkpoints to {0} failed".format(self.directory)) from self._error
+
+    def close(self):
+        if not self._thread.is_alive():
+            return
+        self._jobs.put(None)
+        self._thread.join()
+        atexit.unregister(self.close)
+        if self._error is not None:
+            raise RuntimeError("Writing checkpoints to {0} failed".format(self.directory)) from self._error
@@ -0,0 +1,150 @@
+import math
+from typing import List, Optional, Sequence
+
+import neat
+import numba as nb
+import numpy as np
+from neat.graphs import feed_forward_layers
+
+# Activation codes understood by _execute
+ACTIVATION_CODES = {"identity": 0, "sigmoid": 1, "tanh": 2, "relu": 3, "clamped": 4}
+
+
+@nb.njit(cache=True)
+def _activate(code: int, z: float) -> float:
+    # Same formulas as neat.activations
+    if code == 1:
+        z = max(-60.0, min(60.0, 5.0 * z))
+        return 1.0 / (1.0 + math.exp(-z))
+    if code == 2:
+        z = max(-60.0, min(60.0, 2.5 * z))
+        return math.tanh(z)
+    if code == 3:
+        return z if z > 0.0 else 0.0
+    if code == 4:
+        return max(-1.0, min(1.0, z))
+    return z
+
+
+@nb.njit(cache=True)
+def _execute(inputs: np.ndarray,
+             genome_index: np.ndarray,
+             node_start: np.ndarray,
+             link_start: np.ndarray,
+             link_src: np.ndarray,
+             link_weight: np.ndarray,
+             bias: np.ndarray,
+             response: np.ndarray,
+             activation: np.ndarray,
+             output_slots: np.ndarray,
+             max_slots: int,
+             outputs: np.ndarray) -> np.ndarray:
+    num_rows, num_inputs = inputs.shape
+    for r in range(num_rows):
+        g = genome_index[r]
+        values = np.empty(max_slots, dtype=np.float64)
+        values[:num_inputs] = inputs[r]
+        for k in range(node_start[g], node_start[g + 1]):
+            # Accumulate in connection order, like FeedForwardNetwork.activate
+            s = 0.0
+            for l in range(link_start[k], link_start[k + 1]):
+                s += values[link_src[l]] * link_weight[l]
+            values[num_inputs + k - node_start[g]] = _activate(activation[k], bias[k] + response[k] * s)
+        for o in range(output_slots.shape[1]):
+            slot = output_slots[g, o]
+            outputs[r, o] = values[slot] if slot >= 0 else 0.0
+    return outputs
+
+
+class CompiledPolicy:
+    """
+    A batch of genomes flattened into topologically ordered array programs.
+
+    Every genome becomes the same nodes, in the same order, with the same
+    links as neat.nn.FeedForwardNetwork.create would build, stored as flat
+    arrays: per-node bias, response and activation code, and per-node slices
+    of (source slot, weight) links. Slots 0..num_inputs-1 hold the network
+    inputs and slot num_inputs+k the k-th evaluated node of a genome.
+    Outputs that no path reaches stay 0.0, as in FeedForwardNetwork.
+    """
+    def __init__(self, genomes: Sequence[neat.DefaultGenome], config: neat.Config):
+        genome_config = config.genome_config
+        input_keys: List[int] = list(genome_config.input_keys)
+        output_keys: List[int] = list(genome_config.output_keys)
+        self.num_inputs = len(input_keys)
+        self.num_outputs = len(output_keys)
+        self.num_genomes = len(genomes)
+
+        node_start, link_start = [0], [0]
+        link_src, link_weight = [], []
+        bias, response, activation = [], [], []
+        output_slots = np.full((len(genomes), len(output_keys)), -1, dtype=np.int64)
+        max_slots = self.num_inputs
+        for gi, genome in enumerate(genomes):
+            connections = [cg.key for cg in genome.connections.values() if cg.enabled]
+            layers = feed_forward_layers(input_keys, output_keys, connections)
+            slots = {key: i for i, key in enumerate(input_keys)}
+            for layer in layers:
+                for node in sorted(layer):
+                    for inode, onode in connections:
+                        if onode == node:
+                            link_src.append(slots[inode])
+                            link_weight.append(genome.connections[(inode, onode)].weight)
+                    link_start.append(len(link_src))
+                    ng = genome.nodes[node]
+                    if ng.aggregation != "sum":
+                        raise ValueError("Unsupported aggregation function: {0}".format(ng.aggregation))
+                    if ng.activation not in ACTIVATION_CODES:
+                        raise ValueError("Unsupported activation function: {0}".format(ng.activation))
+                    bias.append(ng.bias)
+                    response.append(ng.response)
+                    activation.append(ACTIVATION_CODES[ng.activation])
+                    slots[node] = len(slots)
+            node_start.append(len(bias))
+            max_slots = max(max_slots, len(slots))
+            for oi, key in enumerate(output_keys):
+                output_slots[gi, oi] = slots.get(key, -1)
+
+        self.node_start = np.asarray(node_start, dtype=np.int64)
+        self.link_start = np.asarray(link_start, dtype=np.int64)
+        self.link_src = np.asarray(link_src, dtype=np.int64)
+        self.link_weight = np.asarray(link_weight, dtype=np.float64)
+        self.bias = np.asarray(bias, dtype=np.float64)
+        self.response = np.asarray(response, dtype=np.float64)
+        self.activation = np.asarray(activation, dtype=np.int64)
+        self.output_slots = output_slots
+        self.max_slots = max_slots
+        self._zero_index = np.zeros((1,), dtype=np.int64)
+
+    def activate(self, inputs: np.ndarray, genome_index: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Evaluate rows of inputs (num_rows, num_inputs), row r with genome
+        genome_index[r]. genome_index defaults to genome 0 for every row.
+        A single input vector gives a single output vector.
+        """
+        inputs = np.asarray(inputs, dtype=np.float64)
+        single = inputs.ndim == 1
+        if single:
+            inputs = inputs[None, :]
+        if inputs.shape[1] != self.num_inputs:
+            raise RuntimeError("Expected {0:n} inputs, got {1:n}".format(self.num_inputs, inputs.shape[1]))
+        if genome_index is None:
+            genome_index = self._zero_index if single else np.zeros((len(inputs),), dtype=np.int64)
+        outputs = np.empty((len(inputs), self.num_outputs), dtype=np.float64)
+        _execute(inputs, np.asarray(genome_index, dtype=np.int64),
+                 self.node_start, self.link_start, self.link_src, self.link_weight,
+                 self.bias, self.response, self.activation, self.output_slots,
+                 self.max_slots, outputs)
+        return outputs[0] if single else outputs
+
+    def activate_all(self, inputs: np.ndarray) -> np.ndarray:
+        """ Every genome on every row of inputs, shape (num_genomes, num_rows, num_outputs). """
+        inputs = np.atleast_2d(np.asarray(inputs, dtype=np.float64))
+        genome_index = np.repeat(np.arange(self.num_genomes), len(inputs))
+        outputs = self.activate(np.tile(inputs, (self.num_genomes, 1)), genome_index)
+        return outputs.reshape(self.num_genomes, len(inputs), self.num_outputs)
+
+
+def compile_policy(genome: neat.DefaultGenome, config: neat.Config) -> CompiledPolicy:
+    """ Compiled stand-in for neat.nn.FeedForwardNetwork.create(genome, config). """
+    return CompiledPolicy([genome], config)
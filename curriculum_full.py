@@ -1,73 +1,181 @@
-import math
-from typing import List, Optional, Tuple, Union
+from __future__ import annotations
+
+import time
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Sequence, Tuple, Union
 import random
 
-import torch
+import numpy as np
 import neat
 import neat.config
-import pygame
-from miner_objects import (BLACK, HEIGHT, WHITE, WIDTH, Asteroid, Mineral,
-                           Spaceship)
-from pygame.surface import Surface
-from utils import apply_action, generate_inputs, setup_encoder
+from batch_simulator import BatchMinerEnv
+from compiled_policy import CompiledPolicy, compile_policy
+from features import ObservationBuffer
+from miner_objects import (BLACK, HEIGHT, IDLE_PENALTY, MAX_EPISODE_TIME,
+                           MAX_IDLE_TIME, MIN_MINERALS, MINERAL_REWARD,
+                           NUM_ASTEROIDS, NUM_MINERALS, TERMINAL_PENALTY, WHITE,
+                           WIDTH, Asteroid, Mineral, Spaceship)
+from numpy_encoder import NumpyEncoder
+from profiler import PhaseProfiler
+from spatial_hash import SpatialHash
+from utils import apply_action, setup_encoder
 
-@torch.no_grad()
-def run_full(genome: neat.DefaultGenome, 
-                config: neat.Config, 
-                visualizer: Optional[Surface]=None):
-    
+if TYPE_CHECKING:
+    # torch and pygame are imported on first use: run_full with a NumpyEncoder
+    # never loads torch, and headless run_full never loads pygame
+    from embedding_cache import EmbeddingCache
+    from encoder import Encoder
+    from pygame.surface import Surface
+
+
+def policy_input_function(encoder: Union["Encoder", "EmbeddingCache", NumpyEncoder],
+                          profiler: Optional[PhaseProfiler]=None)->Callable[[Spaceship, List[Mineral], List[Asteroid]], np.ndarray]:
+    """
+    Function mapping a scene to the policy inputs, the ship embedding
+    followed by the graph embedding, with encoder.
+    With a profiler, the function laps its "inputs", "encoder" and
+    "embedding" phases.
+    The scene is written into an ObservationBuffer and the embeddings into
+    one float32 array, both held by the returned function and reused every
+    call, so the array returned is overwritten by the next call.
+    """
+    observation = ObservationBuffer()
+    # Allocated on the first call, once the embedding sizes are known
+    policy_inputs: Optional[np.ndarray] = None
+
+    # An EmbeddingCache keeps the encoder it wraps in .encoder
+    if isinstance(getattr(encoder, "encoder", encoder), NumpyEncoder):
+        def numpy_policy_inputs(ship: Spaceship, minerals: List[Mineral], asteroids: List[Asteroid])->np.ndarray:
+            nonlocal policy_inputs
+            features = observation.fill(ship, minerals, asteroids)
+            if profiler is not None:
+                profiler.lap("inputs")
+            obj_embeds, graph_embeds = encoder(*features)
+            if profiler is not None:
+                profiler.lap("encoder")
+            if policy_inputs is None:
+                policy_inputs = np.empty((obj_embeds.shape[1] + graph_embeds.shape[1],), dtype=np.float32)
+            np.concatenate((obj_embeds[0], graph_embeds[0]), out=policy_inputs)
+            if profiler is not None:
+                profiler.lap("embedding")
+            return policy_inputs
+        return numpy_policy_inputs
+
+    import torch
     torch.set_num_threads(1)       # Limit intra-op parallelism (e.g., matrix mult)
     # torch.set_num_interop_threads(1) 
-    pygame.init()
+    policy_inputs_tensor: Optional[torch.Tensor] = None
+
+    @torch.no_grad()
+    def torch_policy_inputs(ship: Spaceship, minerals: List[Mineral], asteroids: List[Asteroid])->np.ndarray:
+        nonlocal policy_inputs, policy_inputs_tensor
+        features = observation.fill_tensors(ship, minerals, asteroids)
+        if profiler is not None:
+            profiler.lap("inputs")
+        obj_embeds, graph_embeds = encoder(*features)
+        if profiler is not None:
+            profiler.lap("encoder")
+        if policy_inputs is None:
+            policy_inputs = np.empty((obj_embeds.shape[1] + graph_embeds.shape[1],), dtype=np.float32)
+            policy_inputs_tensor = torch.from_numpy(policy_inputs)
+        torch.cat((obj_embeds[0], graph_embeds[0]), out=policy_inputs_tensor)
+        if profiler is not None:
+            profiler.lap("embedding")
+        return policy_inputs
+    return torch_policy_inputs
+
+
+def run_full(genome: neat.DefaultGenome, 
+                config: neat.Config, 
+                visualizer: Optional[Surface]=None,
+                encoder: Optional[Union["Encoder", "EmbeddingCache", NumpyEncoder]]=None,
+                timings: Optional[Dict[str, float]]=None,
+                seed: Optional[int]=None,
+                profile: bool=False):
+    """
+    Play one episode with genome and return its reward.
+
+    encoder can be passed in by callers that keep one loaded across episodes,
+    possibly behind an EmbeddingCache, or a NumpyEncoder, which keeps the
+    episode free of torch; otherwise encoder.pth is loaded here. If timings is given, the seconds spent
+    setting up the episode and simulating it are added to its "setup" and
+    "simulation" entries.
+    Without a visualizer the episode runs headless and pygame is never touched.
+    The timings entries "episodes" and "ticks" count the episodes and ticks played.
+    With profile, every tick is split into phases by a PhaseProfiler whose
+    totals are added to timings (see profiler.PhaseProfiler.add_to).
+    With seed, the scenario comes from its own random.Random(seed) and is the
+    same episode as random.seed(seed) followed by run_full without a seed;
+    otherwise it is drawn from the global random module.
+    """
+    setup_start = time.perf_counter()
     screen = None
     if visualizer is not None:
+        import pygame
+        pygame.init()
         screen = pygame.display.set_mode((WIDTH, HEIGHT))
         pygame.display.set_caption("NEAT - Space Miner Training")
-    clock = pygame.time.Clock()
-    encoder = setup_encoder()
+        clock = pygame.time.Clock()
+    if encoder is None:
+        encoder = setup_encoder()
     encoder.eval()
-    policy = neat.nn.FeedForwardNetwork.create(genome, config)
+    profiler = PhaseProfiler() if profile else None
+    policy_inputs = policy_input_function(encoder, profiler)
+    policy = compile_policy(genome, config)
+    rng = random.Random(seed) if seed is not None else None
     ship = Spaceship(screen)
-    asteroids = [Asteroid(screen) for _ in range(8)]
-    minerals = [Mineral(screen) for _ in range(5)]
+    asteroids = [Asteroid(screen, rng) for _ in range(NUM_ASTEROIDS)]
+    minerals = [Mineral(screen, rng) for _ in range(NUM_MINERALS)]
+    # Broad-phase indices for mining and collisions, kept in sync with the lists
+    asteroid_index = SpatialHash()
+    for asteroid in asteroids:
+        asteroid_index.insert(asteroid, asteroid.x, asteroid.y, asteroid.radius)
+    mineral_index = SpatialHash()
+    for mineral in minerals:
+        mineral_index.insert(mineral, mineral.x, mineral.y, mineral.radius)
     
     alive_time = 0
     idle_time = 0
-    MAX_IDLE_TIME = 300
     reward = 0.
+    simulation_start = time.perf_counter()
     while True:
         alive_time += 1
-        
-        # Handle events
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                pygame.quit()
-                return
-        
+        if profiler is not None:
+            profiler.start()
         
         if screen is not None:
+            # Handle events
+            for event in pygame.event.get():
+                if event.type == pygame.QUIT:
+                    pygame.quit()
+                    return
             screen.fill(BLACK)
-        ship_data, asteroids_data, minerals_data = generate_inputs(ship, minerals, asteroids)
-        obj_embeds, graph_embeds = encoder(ship_data, asteroids_data, minerals_data)
-        ship_embed = obj_embeds[0]
-        graph_embed = graph_embeds[0]
-        inputs = torch.cat((ship_embed, graph_embed)).tolist()
+            if profiler is not None:
+                profiler.lap("render")
+        inputs = policy_inputs(ship, minerals, asteroids)
         # Get actions from network
         output = policy.activate(inputs)
+        if profiler is not None:
+            profiler.lap("policy")
         
         # Execute actions
         old_x, old_y = ship.x, ship.y
-        num_minerals_mined = apply_action(ship, output, minerals)
+        num_minerals_mined = apply_action(ship, output, minerals, mineral_index)
         if old_x == ship.x and old_y == ship.y:
-            reward -= 0.2
+            reward -= IDLE_PENALTY
             idle_time += 1
         else:
             idle_time = 0
         
-        reward += num_minerals_mined*20
-        if len(minerals) <= 2:
-            while len(minerals) < 5:
-                minerals.append(Mineral(screen))
+        reward += num_minerals_mined*MINERAL_REWARD
+        if profiler is not None:
+            profiler.lap("action")
+        if len(minerals) <= MIN_MINERALS:
+            while len(minerals) < NUM_MINERALS:
+                mineral = Mineral(screen, rng)
+                minerals.append(mineral)
+                mineral_index.insert(mineral, mineral.x, mineral.y, mineral.radius)
+            if profiler is not None:
+                profiler.lap("respawn")
 
         # Visualization
         if screen is not None:
@@ -76,29 +184,112 @@ def run_full(genome: neat.DefaultGenome,
                 mineral.draw()
             for asteroid in asteroids:
                 asteroid.move()
+                asteroid_index.move(asteroid, asteroid.x, asteroid.y)
                 asteroid.draw()
             ship.draw()
             visualizer.draw_stats(screen, reward, ship.minerals, ship)
             pygame.display.flip()
             clock.tick(30)
+            if profiler is not None:
+                profiler.lap("render")
         
         # Termination conditions
+        # Only the closest asteroid is tested, and it can only hit the ship
+        # if its centre is within ship.radius + the largest asteroid radius
         asteroid_collision = False
-        closest_asteroid = min((a for a in asteroids), 
-                            key=lambda a: math.hypot(ship.x-a.x, ship.y-a.y),
-                            default=None)
+        closest_asteroid, closest_dist = asteroid_index.nearest(ship.x, ship.y, ship.radius + asteroid_index.max_radius)
         if closest_asteroid is not None:        
-            asteroid_collision = math.hypot(ship.x-closest_asteroid.x, ship.y-closest_asteroid.y) < ship.radius + closest_asteroid.radius
+            asteroid_collision = closest_dist < ship.radius + closest_asteroid.radius
         out_of_fuel = ship.fuel <= 0
         # no_minerals_left = not minerals and ship.minerals == 0
         too_idle = idle_time >= MAX_IDLE_TIME
+        if profiler is not None:
+            profiler.lap("collision")
         if too_idle:
-            reward += -500
+            reward += -TERMINAL_PENALTY
             break
         if asteroid_collision:
-            reward -= 500
+            reward -= TERMINAL_PENALTY
             break
-        if out_of_fuel or alive_time >= 5000:
+        if out_of_fuel or alive_time >= MAX_EPISODE_TIME:
             break
-    pygame.quit()
-    return reward
\ No newline at end of file
+    if timings is not None:
+        timings["setup"] = timings.get("setup", 0.) + simulation_start - setup_start
+        timings["simulation"] = timings.get("simulation", 0.) + time.perf_counter() - simulation_start
+        timings["episodes"] = timings.get("episodes", 0) + 1
+        timings["ticks"] = timings.get("ticks", 0) + alive_time
+        if profiler is not None:
+            profiler.add_to(timings)
+    if screen is not None:
+        pygame.quit()
+    return reward
+
+def run_full_batch(genomes: Sequence[neat.DefaultGenome],
+                   config: neat.Config,
+                   seeds: Sequence[int],
+                   encoder: Optional["Encoder"]=None,
+                   timings: Optional[Dict[str, float]]=None,
+                   profile: bool=False)->List[float]:
+    """
+    Headless run_full for many episodes at once, genomes[i] playing the
+    episode seeded with seeds[i]. The environment replays the same episode
+    as run_full(genomes[i], config, seed=seeds[i]); the
+    running scenes go through the encoder as one padded batch per tick, so
+    embeddings agree with run_full up to float32 rounding.
+    Finished episodes are compacted out of the batch as soon as they end.
+    If timings is given, the episodes and ticks played are added to its
+    "episodes" and "ticks" entries, as in run_full, and with profile the
+    time of each batched phase of a tick.
+    """
+    import torch
+    torch.set_num_threads(1)
+    if encoder is None:
+        encoder = setup_encoder()
+    encoder.eval()
+    # A genome may play several episodes, compile each one once
+    unique_genomes = {id(genome): genome for genome in genomes}
+    genome_rows = {key: row for row, key in enumerate(unique_genomes)}
+    policy = CompiledPolicy(list(unique_genomes.values()), config)
+    genome_index = np.asarray([genome_rows[id(genome)] for genome in genomes], dtype=np.int64)
+
+    env = BatchMinerEnv(seeds)
+    rewards = np.zeros((env.num_episodes,), dtype=np.float64)
+    episode_index = np.arange(env.num_episodes)
+    num_ticks = 0
+    profiler = PhaseProfiler() if profile else None
+    with torch.no_grad():
+        while env.num_episodes > 0:
+            num_ticks += env.num_episodes
+            if profiler is not None:
+                profiler.start()
+            ship_data, asteroids_data, minerals_data = env.observe()
+            if profiler is not None:
+                profiler.lap("inputs")
+            obj_embeds, graph_embeds = encoder.forward_batch(torch.from_numpy(ship_data),
+                                                             torch.from_numpy(asteroids_data),
+                                                             torch.from_numpy(minerals_data),
+                                                             torch.from_numpy(env.num_asteroids),
+                                                             torch.from_numpy(env.num_minerals))
+            if profiler is not None:
+                profiler.lap("encoder")
+            inputs = torch.cat((obj_embeds[:, 0], graph_embeds), dim=1).numpy()
+            if profiler is not None:
+                profiler.lap("embedding")
+            actions = policy.activate(inputs, genome_index[episode_index])
+            if profiler is not None:
+                profiler.lap("policy")
+            done = env.step(actions)
+            if profiler is not None:
+                profiler.lap("step")
+            if done.any():
+                rewards[episode_index[done]] = env.reward[done]
+                env.compact(~done)
+                episode_index = episode_index[~done]
+                if profiler is not None:
+                    profiler.lap("compact")
+    if timings is not None:
+        timings["episodes"] = timings.get("episodes", 0) + len(rewards)
+        timings["ticks"] = timings.get("ticks", 0) + num_ticks
+        if profiler is not None:
+            profiler.add_to(timings)
+    return rewards.tolist()
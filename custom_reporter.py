@@ -1,60 +1,132 @@
-import gzip
 import pathlib
-import pickle
 import random
+from typing import Optional
 
 import neat
 from neat.reporting import BaseReporter
-from torch.utils.tensorboard import SummaryWriter
 
+from checkpoint_writer import CheckpointWriter
+from fitness_cache import FitnessCache
+from metrics import MetricsSink, throughput
+from profiler import format_phases, phase_totals
+
+
+def save_best_checkpoint(writer:CheckpointWriter, config, population, species_set, generation, best_genome):
+    """
+    Queue the population checkpoint and the best genome on writer. Both are
+    pickled here, so the generation loop only waits for the snapshot and
+    never for compression or disk I/O.
+    """
+    print("Saving checkpoint to {0}".format(writer.directory/"best_population_checkpoint"))
+    writer.save("best_population_checkpoint",
+                (generation, config, population, species_set, random.getstate()),
+                generation)
+    writer.save("best_genome", best_genome, generation)
 
 
 class NewBestReport(BaseReporter):
     def __init__(self, 
                  checkpoint_dir:pathlib.Path,
                  logdir:pathlib.Path,
+                 fitness_cache:Optional[FitnessCache]=None,
+                 checkpoint_writer:Optional[CheckpointWriter]=None,
+                 metrics:Optional[MetricsSink]=None,
                  ):
         super().__init__()
         self.best_fitness = -float("inf")
         self.checkpoint_dir = checkpoint_dir
         self.checkpoint_dir.mkdir(parents=True, exist_ok=True)
+        self.checkpoint_writer = checkpoint_writer or CheckpointWriter(checkpoint_dir)
         self.log_dir = logdir
-        self.log_dir.mkdir(parents=True, exist_ok=True)
+        self.metrics = metrics or MetricsSink(logdir)
         self.current_generation = 0
+        # Logged with the fitness when the evaluator is a CachedEvaluator
+        self.fitness_cache = fitness_cache
 
     def start_generation(self, generation):
         self.current_generation = generation
     
     def post_evaluate(self, config, population, species, best_genome):
         self.current_generation += 1
-        writer: SummaryWriter = SummaryWriter(log_dir=self.log_dir.absolute())
-        writer.add_scalar("Current Population Best Fitness", best_genome.fitness, self.current_generation)
+        self.metrics.add_scalar("Current Population Best Fitness", best_genome.fitness, self.current_generation)
         if self.best_fitness < best_genome.fitness:
             self.best_fitness = best_genome.fitness
             self.save_current_best(config, population, species, self.current_generation, best_genome)
-        writer.add_scalar("Overall Best Fitness", self.best_fitness, self.current_generation)
+        self.metrics.add_scalar("Overall Best Fitness", self.best_fitness, self.current_generation)
+        if self.fitness_cache is not None:
+            self.metrics.add_scalar("Fitness Cache Hit Rate", self.fitness_cache.hit_rate, self.current_generation)
+            self.metrics.add_scalar("Fitness Cache Time Saved", self.fitness_cache.time_saved, self.current_generation)
 
     def save_current_best(self, config, population:neat.Population, species_set, generation, best_genome):
         """ Save the current simulation state. """
-        filename = "best_population_checkpoint"
-        filepath = self.checkpoint_dir/filename
+        save_best_checkpoint(self.checkpoint_writer, config, population, species_set, generation, best_genome)
+
+class MetricsReport(BaseReporter):
+    """
+    Per-generation population statistics on a shared MetricsSink: the
+    fitness distribution, species sizes, genome complexity and, given the
+    evaluator, its episodes/s, ticks/s and, when it profiles, the seconds
+    spent in every phase of the tick.
+    """
+    def __init__(self, metrics:MetricsSink, evaluator=None):
+        super().__init__()
+        self.metrics = metrics
+        self.evaluator = evaluator
+        self.current_generation = 0
+
+    def __getstate__(self) -> dict:
+        # Checkpoints pickle the reporters through the species set, the evaluator and its workers stay behind
+        return {**self.__dict__, "evaluator": None}
+
+    def start_generation(self, generation):
+        self.current_generation = generation
 
-        print("Saving checkpoint to {0}".format(filename))
+    def post_evaluate(self, config, population, species, best_genome):
+        # Same step as NewBestReport
+        step = self.current_generation + 1
+        fitnesses = [genome.fitness for genome in population.values() if genome.fitness is not None]
+        num_nodes = [len(genome.nodes) for genome in population.values()]
+        num_connections = [sum(cg.enabled for cg in genome.connections.values()) for genome in population.values()]
+        species_sizes = [len(s.members) for s in species.species.values()]
+        self.metrics.add_histogram("Fitness", fitnesses, step)
+        self.metrics.add_histogram("Species Size", species_sizes, step)
+        self.metrics.add_histogram("Genome Nodes", num_nodes, step)
+        self.metrics.add_histogram("Genome Enabled Connections", num_connections, step)
+        self.metrics.add_scalars({"Mean Fitness": sum(fitnesses) / max(len(fitnesses), 1),
+                                  "Population Size": len(population),
+                                  "Number of Species": len(species_sizes),
+                                  "Mean Genome Nodes": sum(num_nodes) / max(len(num_nodes), 1),
+                                  "Mean Genome Enabled Connections": sum(num_connections) / max(len(num_connections), 1)},
+                                 step)
+        timings = getattr(self.evaluator, "generation_timings", None)
+        if timings:
+            self.metrics.add_scalars(throughput(timings[-1]), step)
+            for phase, seconds, _ in phase_totals(timings[-1]):
+                self.metrics.add_scalar("Phase Seconds/" + phase, seconds, step)
+
+
+class ProfileReport(BaseReporter):
+    """ Prints the per-phase tick profile of the generation the evaluator just ran with profile on. """
+    def __init__(self, evaluator):
+        super().__init__()
+        self.evaluator = evaluator
 
-        with gzip.open(filepath.absolute(), 'wb', compresslevel=5) as f:
-            data = (generation, config, population, species_set, random.getstate())
-            pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+    def __getstate__(self) -> dict:
+        return {**self.__dict__, "evaluator": None}
+
+    def post_evaluate(self, config, population, species, best_genome):
+        timings = getattr(self.evaluator, "generation_timings", None)
+        if timings and phase_totals(timings[-1]):
+            print("Tick profile, summed over workers:")
+            print(format_phases(timings[-1]))
 
-        best_genome_filename = "best_genome"
-        best_genome_filepath = self.checkpoint_dir/best_genome_filename
-        with gzip.open(best_genome_filepath.absolute(), 'wb', compresslevel=5) as f:
-            pickle.dump(best_genome, f, protocol=pickle.HIGHEST_PROTOCOL)
 
 class EarlyStoppingReport(BaseReporter):
     def __init__(self, 
                  simulation_eval,
                  checkpoint_dir:pathlib.Path,
                  fitness_target:float=10,
+                 checkpoint_writer:Optional[CheckpointWriter]=None,
                  ):
         super().__init__()
         self.best_fitness = -float("inf")
@@ -62,6 +134,7 @@ class EarlyStoppingReport(BaseReporter):
         self.simulation_eval = simulation_eval
         self.checkpoint_dir = checkpoint_dir
         self.checkpoint_dir.mkdir(parents=True, exist_ok=True)
+        self.checkpoint_writer = checkpoint_writer or CheckpointWriter(checkpoint_dir)
         self.current_generation = 0
 
     def start_generation(self, generation):
@@ -77,17 +150,4 @@ class EarlyStoppingReport(BaseReporter):
 
     def save_current_best(self, config, population:neat.Population, species_set, generation, best_genome):
         """ Save the current simulation state. """
-        filename = "best_population_checkpoint"
-        filepath = self.checkpoint_dir/filename
-
-        print("Saving checkpoint to {0}".format(filename))
-
-        with gzip.open(filepath.absolute(), 'wb', compresslevel=5) as f:
-            data = (generation, config, population, species_set, random.getstate())
-            pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
-
-        best_genome_filename = "best_genome"
-        best_genome_filepath = self.checkpoint_dir/best_genome_filename
-        with gzip.open(best_genome_filepath.absolute(), 'wb', compresslevel=5) as f:
-            pickle.dump(best_genome, f, protocol=pickle.HIGHEST_PROTOCOL)
-
+        save_best_checkpoint(self.checkpoint_writer, config, population, species_set, generation, best_genome)
@@ -33,7 +33,48 @@ class Encoder(nn.Module):
         graph_embeds = graph_embeds[0]
         graph_embeds = self.graph_proj(graph_embeds)
         return obj_embeds, graph_embeds
-    
+
+    def forward_batch(self,
+                      ship_data: torch.Tensor,
+                      asteroids_data: torch.Tensor,
+                      minerals_data: torch.Tensor,
+                      num_asteroids: torch.Tensor,
+                      num_minerals: torch.Tensor)->Tuple[torch.Tensor, torch.Tensor]:
+        """
+        forward for B scenes at once, with asteroids and minerals padded to
+        the largest scene in the batch.
+
+        :param ship_data: (B, 5)
+        :param asteroids_data: (B, max_asteroids, 5)
+        :param minerals_data: (B, max_minerals, 2)
+        :param num_asteroids: (B,) number of real asteroid rows per scene
+        :param num_minerals: (B,) number of real mineral rows per scene
+        :return: object embeddings (B, 1+max_asteroids+max_minerals, 8) laid out
+            as ship, asteroids, minerals, and graph embeddings (B, 8)
+        """
+        ship_embed = self.ship_fc(ship_data[:, None, :])
+        asteroids_embed = self.asteroid_fc(asteroids_data)
+        minerals_embed = self.mineral_fc(minerals_data)
+        raw_embeds = torch.concatenate((ship_embed, asteroids_embed, minerals_embed), dim=1)
+        mask = padding_mask(num_asteroids, num_minerals, asteroids_data.shape[1], minerals_data.shape[1])
+        obj_embeds, graph_embeds = self.gae.forward_masked(raw_embeds, mask)
+        obj_embeds = self.obj_proj(obj_embeds)
+        graph_embeds = self.graph_proj(graph_embeds[:, 0])
+        return obj_embeds, graph_embeds
+
+
+def padding_mask(num_asteroids: torch.Tensor,
+                 num_minerals: torch.Tensor,
+                 max_asteroids: int,
+                 max_minerals: int)->torch.Tensor:
+    """ (B, 1+max_asteroids+max_minerals) mask of the padding rows in a forward_batch scene. """
+    num_asteroids = torch.as_tensor(num_asteroids)
+    num_minerals = torch.as_tensor(num_minerals)
+    ship_mask = torch.zeros((len(num_asteroids), 1), dtype=torch.bool)
+    asteroids_mask = torch.arange(max_asteroids)[None, :] >= num_asteroids[:, None]
+    minerals_mask = torch.arange(max_minerals)[None, :] >= num_minerals[:, None]
+    return torch.concatenate((ship_mask, asteroids_mask, minerals_mask), dim=1)
+
 class Decoder(nn.Module):
     def __init__(self):
         super().__init__()
@@ -66,6 +107,24 @@ class Decoder(nn.Module):
         minerals_embed = torch.concatenate((minerals_embed, torch.repeat_interleave(graph_embed, len(minerals_embed), dim=0)), dim=1)
         minerals_data = self.mineral_fc((minerals_embed))
         return ship_data, asteroids_data, minerals_data
+
+    def forward_batch(self,
+                      ship_embed:torch.Tensor,
+                      asteroids_embed: torch.Tensor,
+                      minerals_embed: torch.Tensor,
+                      graph_embed:torch.Tensor
+                      )->Tuple[torch.Tensor,torch.Tensor,torch.Tensor]:
+        """
+        forward for B scenes at once: ship_embed and graph_embed are (B, 8),
+        asteroids_embed (B, max_asteroids, 8) and minerals_embed (B, max_minerals, 8).
+        Padding rows are decoded like the others and must be masked by the caller.
+        """
+        ship_data = self.ship_fc(torch.concatenate((ship_embed, graph_embed), dim=1))
+        asteroids_graph_embed = graph_embed[:, None, :].expand(-1, asteroids_embed.shape[1], -1)
+        asteroids_data = self.asteroid_fc(torch.concatenate((asteroids_embed, asteroids_graph_embed), dim=2))
+        minerals_graph_embed = graph_embed[:, None, :].expand(-1, minerals_embed.shape[1], -1)
+        minerals_data = self.mineral_fc(torch.concatenate((minerals_embed, minerals_graph_embed), dim=2))
+        return ship_data, asteroids_data, minerals_data
     
     
 class AutoEncoder(nn.Module):
@@ -89,4 +148,17 @@ class AutoEncoder(nn.Module):
                                                                                minerals_embed,
                                                                                graph_embed)
         return ship_data_pred, asteroids_data_pred, minerals_data_pred
-        
\ No newline at end of file
+
+    def forward_batch(self,
+                      ship_data: torch.Tensor,
+                      asteroids_data: torch.Tensor,
+                      minerals_data: torch.Tensor,
+                      num_asteroids: torch.Tensor,
+                      num_minerals: torch.Tensor)->Tuple[torch.Tensor,torch.Tensor,torch.Tensor]:
+        """ forward for B padded scenes, see Encoder.forward_batch for the layout. """
+        max_asteroids = asteroids_data.shape[1]
+        obj_embeds, graph_embed = self.encoder.forward_batch(ship_data, asteroids_data, minerals_data, num_asteroids, num_minerals)
+        ship_embed = obj_embeds[:, 0, :]
+        asteroids_embed = obj_embeds[:, 1:max_asteroids+1, :]
+        minerals_embed = obj_embeds[:, max_asteroids+1:, :]
+        return self.decoder.forward_batch(ship_embed, asteroids_embed, minerals_embed, graph_embed)
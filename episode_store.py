@@ -0,0 +1,295 @@
+"""
+Binary columnar storage for recorded episodes.
+
+An episode is a directory holding one flat little-endian file per column:
+
+    ship.f32              (T, 4)   x, y, fuel, angle
+    asteroids.f32         (sum of asteroids over timesteps, 5)   x, y, speed_x, speed_y, radius
+    minerals.f32          (sum of minerals over timesteps, 2)    x, y
+    asteroid_offsets.i64  (T+1,)   timestep t owns asteroid rows offsets[t]:offsets[t+1]
+    mineral_offsets.i64   (T+1,)   same for mineral rows
+    actions.f32           (T, 3)   turn, thrust, mine taken at each timestep (optional)
+    meta.json             format version and column layout
+
+Files are plain arrays with no header, so they can be appended to while
+recording and memory-mapped when loading. The number of timesteps is
+derived from the file sizes, which keeps a partially written episode
+readable up to its last complete timestep. EpisodeRecorder streams an
+episode to disk this way while it is being played.
+
+Actions are in the policy output convention of utils.apply_action: turn
+is in [0, 1] with 0.5 going straight, thrust and mine are 0 or 1.
+"""
+import json
+import pathlib
+import queue
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+FORMAT_VERSION = 1
+SHIP_COLUMNS = ("x", "y", "fuel", "angle")
+ASTEROID_COLUMNS = ("x", "y", "speed_x", "speed_y", "radius")
+MINERAL_COLUMNS = ("x", "y")
+ACTION_COLUMNS = ("turn", "thrust", "mine")
+# file name -> (dtype, row width)
+FILES: Dict[str, Tuple[str, int]] = {
+    "ship.f32": ("<f4", len(SHIP_COLUMNS)),
+    "asteroids.f32": ("<f4", len(ASTEROID_COLUMNS)),
+    "minerals.f32": ("<f4", len(MINERAL_COLUMNS)),
+    "asteroid_offsets.i64": ("<i8", 1),
+    "mineral_offsets.i64": ("<i8", 1),
+}
+# Columns that episodes recorded before they existed do not have
+OPTIONAL_FILES: Dict[str, Tuple[str, int]] = {
+    "actions.f32": ("<f4", len(ACTION_COLUMNS)),
+}
+ALL_FILES = {**FILES, **OPTIONAL_FILES}
+
+PathLike = Union[str, pathlib.Path]
+
+
+def _map_file(path: pathlib.Path, dtype: str, width: int, mmap: bool) -> np.ndarray:
+    itemsize = np.dtype(dtype).itemsize * width
+    num_rows = path.stat().st_size // itemsize if path.exists() else 0
+    if num_rows == 0:
+        return np.zeros((0, width), dtype=dtype)
+    if mmap:
+        return np.memmap(path, dtype=dtype, mode="r", shape=(num_rows, width))
+    return np.fromfile(path, dtype=dtype, count=num_rows * width).reshape(num_rows, width)
+
+
+class EpisodeArrays:
+    """ Column arrays of one episode, memory-mapped unless loaded with mmap=False. """
+    def __init__(self,
+                 ship: np.ndarray,
+                 asteroids: np.ndarray,
+                 minerals: np.ndarray,
+                 asteroid_offsets: np.ndarray,
+                 mineral_offsets: np.ndarray,
+                 actions: Optional[np.ndarray] = None):
+        self.ship = ship
+        self.asteroids = asteroids
+        self.minerals = minerals
+        self.asteroid_offsets = asteroid_offsets
+        self.mineral_offsets = mineral_offsets
+        # None for episodes recorded without actions
+        self.actions = actions
+
+    def __len__(self) -> int:
+        return len(self.ship)
+
+    def scene(self, t: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """ Raw ship row, asteroid rows and mineral rows of timestep t. """
+        return (self.ship[t],
+                self.asteroids[self.asteroid_offsets[t]:self.asteroid_offsets[t+1]],
+                self.minerals[self.mineral_offsets[t]:self.mineral_offsets[t+1]])
+
+
+def write_meta(directory: PathLike, num_timesteps: Optional[int] = None):
+    """ Write meta.json; num_timesteps is only known, and stored, once the episode is complete. """
+    directory = pathlib.Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    meta = {
+        "version": FORMAT_VERSION,
+        "ship_columns": SHIP_COLUMNS,
+        "asteroid_columns": ASTEROID_COLUMNS,
+        "mineral_columns": MINERAL_COLUMNS,
+        "action_columns": ACTION_COLUMNS,
+        "files": {name: {"dtype": dtype, "width": width} for name, (dtype, width) in ALL_FILES.items()},
+    }
+    if num_timesteps is not None:
+        meta["num_timesteps"] = num_timesteps
+    with open(directory/"meta.json", "w") as f:
+        json.dump(meta, f, indent=2)
+
+
+def write_episode(directory: PathLike,
+                  ship: np.ndarray,
+                  asteroids: np.ndarray,
+                  minerals: np.ndarray,
+                  asteroid_counts: Sequence[int],
+                  mineral_counts: Sequence[int],
+                  actions: Optional[np.ndarray] = None):
+    """ Write a whole episode; asteroid_counts / mineral_counts give the number of rows of each timestep. """
+    directory = pathlib.Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    columns = {
+        "ship.f32": np.asarray(ship).reshape(-1, len(SHIP_COLUMNS)),
+        "asteroids.f32": np.asarray(asteroids).reshape(-1, len(ASTEROID_COLUMNS)),
+        "minerals.f32": np.asarray(minerals).reshape(-1, len(MINERAL_COLUMNS)),
+        "asteroid_offsets.i64": np.concatenate(([0], np.cumsum(asteroid_counts))),
+        "mineral_offsets.i64": np.concatenate(([0], np.cumsum(mineral_counts))),
+    }
+    if actions is not None:
+        columns["actions.f32"] = np.asarray(actions).reshape(-1, len(ACTION_COLUMNS))
+    for name, values in columns.items():
+        dtype, _ = ALL_FILES[name]
+        np.ascontiguousarray(values, dtype=dtype).tofile(directory/name)
+    # meta.json marks the episode as complete
+    write_meta(directory, len(columns["ship.f32"]))
+
+
+class EpisodeRecorder:
+    """
+    Streams an episode to directory while it is played. record() only
+    appends the timestep to in-memory lists; every chunk_size timesteps the
+    lists are handed to a background thread that converts them and appends
+    them to the column files, so the caller never waits on the disk.
+    meta.json is written when recording starts, so an episode cut short by
+    a crash stays loadable up to its last written chunk; close() flushes the
+    rest and adds num_timesteps to meta.json.
+    """
+    def __init__(self, directory: PathLike, chunk_size: int = 256):
+        self.directory = pathlib.Path(directory)
+        self.chunk_size = chunk_size
+        self.num_timesteps = 0
+        self._num_asteroid_rows = 0
+        self._num_mineral_rows = 0
+        self._error: Optional[BaseException] = None
+        self._new_chunk()
+        write_meta(self.directory)
+        for name in ALL_FILES:
+            (self.directory/name).write_bytes(b"")
+        # Both offset columns start at row 0
+        for name in ("asteroid_offsets.i64", "mineral_offsets.i64"):
+            np.zeros((1,), dtype=FILES[name][0]).tofile(self.directory/name)
+        self._chunks: "queue.Queue[Optional[Dict[str, list]]]" = queue.Queue()
+        self._writer = threading.Thread(target=self._write_chunks, name="EpisodeRecorder", daemon=True)
+        self._writer.start()
+
+    def _new_chunk(self):
+        self._chunk: Dict[str, list] = {name: [] for name in ALL_FILES}
+
+    def record(self,
+               ship: Sequence[float],
+               asteroids: Sequence[Sequence[float]],
+               minerals: Sequence[Sequence[float]],
+               action: Sequence[float]):
+        """
+        Append one timestep: the ship row, the asteroid and mineral rows in
+        column order, and the action taken from this state.
+        """
+        if self._error is not None:
+            raise RuntimeError("Writing {0} failed".format(self.directory)) from self._error
+        self._num_asteroid_rows += len(asteroids)
+        self._num_mineral_rows += len(minerals)
+        chunk = self._chunk
+        chunk["ship.f32"].append(ship)
+        chunk["asteroids.f32"].extend(asteroids)
+        chunk["minerals.f32"].extend(minerals)
+        chunk["asteroid_offsets.i64"].append(self._num_asteroid_rows)
+        chunk["mineral_offsets.i64"].append(self._num_mineral_rows)
+        chunk["actions.f32"].append(action)
+        self.num_timesteps += 1
+        if len(chunk["ship.f32"]) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        """ Hand the timesteps recorded since the last flush to the writer thread. """
+        if self._chunk["ship.f32"]:
+            self._chunks.put(self._chunk)
+            self._new_chunk()
+
+    def _write_chunks(self):
+        files = {name: open(self.directory/name, "ab") for name in ALL_FILES}
+        try:
+            while True:
+                chunk = self._chunks.get()
+                if chunk is None:
+                    break
+                if self._error is not None:
+                    continue
+                try:
+                    # Rows before offsets, so an offset never points past the rows on disk
+                    for name, rows in chunk.items():
+                        dtype, width = ALL_FILES[name]
+                        files[name].write(np.asarray(rows, dtype=dtype).reshape(-1, width).tobytes())
+                        files[name].flush()
+                except BaseException as error:
+                    self._error = error
+        finally:
+            for f in files.values():
+                f.close()
+
+    def close(self):
+        """ Write the remaining timesteps, wait for the writer thread and mark the episode complete. """
+        if not self._writer.is_alive():
+            return
+        self.flush()
+        self._chunks.put(None)
+        self._writer.join()
+        if self._error is not None:
+            raise RuntimeError("Writing {0} failed".format(self.directory)) from self._error
+        write_meta(self.directory, self.num_timesteps)
+
+    def __enter__(self) -> "EpisodeRecorder":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def load_episode(directory: PathLike, mmap: bool = True) -> EpisodeArrays:
+    directory = pathlib.Path(directory)
+    arrays = {name: _map_file(directory/name, dtype, width, mmap) for name, (dtype, width) in FILES.items()}
+    actions = None
+    if (directory/"actions.f32").is_file():
+        dtype, width = OPTIONAL_FILES["actions.f32"]
+        actions = _map_file(directory/"actions.f32", dtype, width, mmap)
+    asteroid_offsets = arrays["asteroid_offsets.i64"][:, 0]
+    mineral_offsets = arrays["mineral_offsets.i64"][:, 0]
+    # Only keep timesteps whose rows were all written
+    num_timesteps = min(len(arrays["ship.f32"]), len(asteroid_offsets) - 1, len(mineral_offsets) - 1,
+                        len(actions) if actions is not None else len(arrays["ship.f32"]))
+    num_timesteps = max(num_timesteps, 0)
+    while num_timesteps > 0 and (asteroid_offsets[num_timesteps] > len(arrays["asteroids.f32"])
+                                 or mineral_offsets[num_timesteps] > len(arrays["minerals.f32"])):
+        num_timesteps -= 1
+    if num_timesteps == 0:
+        asteroid_offsets = mineral_offsets = np.zeros((1,), dtype=np.int64)
+    return EpisodeArrays(arrays["ship.f32"][:num_timesteps],
+                         arrays["asteroids.f32"],
+                         arrays["minerals.f32"],
+                         asteroid_offsets[:num_timesteps+1],
+                         mineral_offsets[:num_timesteps+1],
+                         actions[:num_timesteps] if actions is not None else None)
+
+
+def episode_dirs(dataset_dir: PathLike) -> List[pathlib.Path]:
+    """ Binary episode directories of a dataset, in episode number order. """
+    dirs = [path for path in pathlib.Path(dataset_dir).glob("episode_*") if (path/"meta.json").is_file()]
+    return sorted(dirs, key=lambda path: int(path.name.split("_")[-1]))
+
+
+def convert_json_episode(json_path: PathLike, directory: PathLike):
+    """ Convert one episode recorded by the old collect_states JSON writer. """
+    with open(json_path, "r") as f:
+        episode_data = json.load(f)
+    ship = [[d["ship"][c] for c in SHIP_COLUMNS] for d in episode_data]
+    asteroids = [[a[c] for c in ASTEROID_COLUMNS] for d in episode_data for a in d["asteroids"]]
+    minerals = [[m[c] for c in MINERAL_COLUMNS] for d in episode_data for m in d["minerals"]]
+    write_episode(directory,
+                  np.asarray(ship, dtype=np.float32),
+                  np.asarray(asteroids, dtype=np.float32),
+                  np.asarray(minerals, dtype=np.float32),
+                  [len(d["asteroids"]) for d in episode_data],
+                  [len(d["minerals"]) for d in episode_data])
+
+
+def convert_json_dataset(dataset_dir: PathLike) -> List[pathlib.Path]:
+    """ Convert every episode_*.json of dataset_dir that has no binary episode yet, returns the new directories. """
+    converted = []
+    for json_path in sorted(pathlib.Path(dataset_dir).glob("episode_*.json")):
+        directory = json_path.with_suffix("")
+        if (directory/"meta.json").is_file():
+            continue
+        print("Converting {0} to {1}".format(json_path, directory))
+        convert_json_episode(json_path, directory)
+        converted.append(directory)
+    return converted
+
+
+if __name__ == "__main__":
+    convert_json_dataset(pathlib.Path("datasets"))
@@ -0,0 +1,44 @@
+from configparser import ConfigParser
+
+from utils import ENCODER_BACKENDS
+
+
+class EvaluationConfig:
+    """
+    Settings of the optional [Evaluation] section of the NEAT config file.
+    neat.Config only reads the sections it knows, so the section can live
+    next to the NEAT parameters.
+    """
+    def __init__(self, filename: str):
+        parameters = ConfigParser()
+        with open(filename) as f:
+            parameters.read_file(f)
+        section = "Evaluation"
+        # "parallel" plays one genome per worker process. "batch" runs the whole
+        # population as one batched rollout in this process, opt-in
+        self.evaluator = parameters.get(section, "evaluator", fallback="parallel")
+        self.num_workers = parameters.getint(section, "num_workers", fallback=8)
+        self.num_samples = parameters.getint(section, "num_samples", fallback=3)
+        # Per-worker EmbeddingCache for the "parallel" evaluator, 0 disables it
+        self.embedding_cache_size = parameters.getint(section, "embedding_cache_size", fallback=0)
+        self.embedding_cache_tolerance = parameters.getfloat(section, "embedding_cache_tolerance", fallback=0.)
+        # Encoder of the "parallel" evaluator's workers, "numpy" keeps torch out of
+        # them and "fused" runs the scripted single-scene FusedEncoder
+        self.encoder_backend = parameters.get(section, "encoder_backend", fallback="torch")
+        # Common random numbers: every genome of a generation plays the same
+        # num_samples scenario seeds, drawn from scenario_seed and redrawn every
+        # seed_refresh_interval generations (0 keeps one set for the whole run).
+        # Opt-in: it changes selection, since genomes are ranked on the same
+        # scenarios instead of each drawing its own
+        self.common_seeds = parameters.getboolean(section, "common_seeds", fallback=False)
+        self.scenario_seed = parameters.getint(section, "scenario_seed", fallback=0)
+        self.seed_refresh_interval = parameters.getint(section, "seed_refresh_interval", fallback=0)
+        # Fitness of genome structures already scored on the common seeds, reused
+        # instead of re-evaluating them. Opt-in, 0 disables it
+        self.fitness_cache_size = parameters.getint(section, "fitness_cache_size", fallback=0)
+        # Time every phase of the simulation tick and report it per generation
+        self.profile = parameters.getboolean(section, "profile", fallback=False)
+        if self.evaluator not in ("batch", "parallel"):
+            raise ValueError("Unknown evaluator: {0}".format(self.evaluator))
+        if self.encoder_backend not in ENCODER_BACKENDS:
+            raise ValueError("Unknown encoder backend: {0}".format(self.encoder_backend))
@@ -0,0 +1,114 @@
+import math
+from typing import TYPE_CHECKING, Dict, Optional, Tuple
+
+import numpy as np
+
+from miner_objects import DIAG, HEIGHT, MAX_FUEL, NUM_ASTEROIDS, NUM_MINERALS, WIDTH
+
+if TYPE_CHECKING:
+    import torch
+
+# Number of features per object, in the column order of utils.generate_inputs
+SHIP_DIM, ASTEROID_DIM, MINERAL_DIM = 5, 5, 2
+# Divisors normalising the raw asteroid (x, y, speed_x, speed_y, radius) and mineral (x, y) columns
+_ASTEROID_SCALE = np.asarray((WIDTH, WIDTH, WIDTH, HEIGHT, DIAG), dtype=np.float64)
+_MINERAL_SCALE = np.asarray((WIDTH, HEIGHT), dtype=np.float64)
+
+
+def ship_features(x: np.ndarray,
+                  y: np.ndarray,
+                  fuel: np.ndarray,
+                  angle: np.ndarray,
+                  out: Optional[np.ndarray] = None) -> np.ndarray:
+    """ Vectorised ship rows of utils.generate_inputs, shape (..., SHIP_DIM). """
+    if out is None:
+        out = np.empty(np.shape(x) + (SHIP_DIM,), dtype=np.float32)
+    out[..., 0] = np.divide(x, WIDTH)
+    out[..., 1] = np.divide(y, HEIGHT)
+    out[..., 2] = np.divide(fuel, MAX_FUEL)
+    out[..., 3] = np.sin(angle)
+    out[..., 4] = np.cos(angle)
+    return out
+
+
+def asteroid_features(x: np.ndarray,
+                      y: np.ndarray,
+                      speed_x: np.ndarray,
+                      speed_y: np.ndarray,
+                      radius: np.ndarray,
+                      out: Optional[np.ndarray] = None) -> np.ndarray:
+    """ Vectorised asteroid rows of utils.generate_inputs, shape (..., ASTEROID_DIM). """
+    if out is None:
+        out = np.empty(np.shape(x) + (ASTEROID_DIM,), dtype=np.float32)
+    out[..., 0] = np.divide(x, WIDTH)
+    out[..., 1] = np.divide(y, WIDTH)
+    out[..., 2] = np.divide(speed_x, WIDTH)
+    out[..., 3] = np.divide(speed_y, HEIGHT)
+    out[..., 4] = np.divide(radius, DIAG)
+    return out
+
+
+def mineral_features(x: np.ndarray,
+                     y: np.ndarray,
+                     out: Optional[np.ndarray] = None) -> np.ndarray:
+    """ Vectorised mineral rows of utils.generate_inputs, shape (..., MINERAL_DIM). """
+    if out is None:
+        out = np.empty(np.shape(x) + (MINERAL_DIM,), dtype=np.float32)
+    out[..., 0] = np.divide(x, WIDTH)
+    out[..., 1] = np.divide(y, HEIGHT)
+    return out
+
+
+class ObservationBuffer:
+    """
+    Reusable feature arrays of one scene, for per-tick rollouts.
+
+    fill writes the scene into preallocated float32 arrays and returns views
+    of their used rows, with the same values as utils.generate_inputs, and
+    fill_tensors returns the same memory as torch tensors through
+    torch.from_numpy, so no lists or new arrays are built per tick. Rows
+    grow when a scene has more objects than the buffers hold. The views
+    are overwritten by the next fill: consume them before filling again.
+    """
+    def __init__(self, max_asteroids: int = NUM_ASTEROIDS, max_minerals: int = NUM_MINERALS):
+        self.ship = np.zeros((SHIP_DIM,), dtype=np.float32)
+        self._allocate(max_asteroids, max_minerals)
+
+    def _allocate(self, max_asteroids: int, max_minerals: int):
+        # Raw float64 columns, normalised into the float32 rows in one ufunc call per object type
+        self.raw_asteroids = np.zeros((max_asteroids, ASTEROID_DIM), dtype=np.float64)
+        self.raw_minerals = np.zeros((max_minerals, MINERAL_DIM), dtype=np.float64)
+        self.asteroids = np.zeros((max_asteroids, ASTEROID_DIM), dtype=np.float32)
+        self.minerals = np.zeros((max_minerals, MINERAL_DIM), dtype=np.float32)
+        # torch views of the buffers, per (num_asteroids, num_minerals), since slicing a tensor costs more than filling it
+        self._tensors: Dict[Tuple[int, int], Tuple["torch.Tensor", "torch.Tensor", "torch.Tensor"]] = {}
+
+    def fill(self, ship, minerals, asteroids) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """ ship (SHIP_DIM,), asteroids (num_asteroids, ASTEROID_DIM) and minerals (num_minerals, MINERAL_DIM) views. """
+        num_asteroids, num_minerals = len(asteroids), len(minerals)
+        if num_asteroids > len(self.asteroids) or num_minerals > len(self.minerals):
+            self._allocate(max(num_asteroids, len(self.asteroids)), max(num_minerals, len(self.minerals)))
+        self.ship[:] = (ship.x/WIDTH, ship.y/HEIGHT, ship.fuel/MAX_FUEL, math.sin(ship.angle), math.cos(ship.angle))
+        raw_asteroids = self.raw_asteroids
+        for i, asteroid in enumerate(asteroids):
+            raw_asteroids[i] = (asteroid.x, asteroid.y, asteroid.speed_x, asteroid.speed_y, asteroid.radius)
+        raw_minerals = self.raw_minerals
+        for i, mineral in enumerate(minerals):
+            raw_minerals[i] = (mineral.x, mineral.y)
+        # Divided in float64 and rounded once to float32, as generate_inputs does
+        asteroids_data = np.divide(raw_asteroids[:num_asteroids], _ASTEROID_SCALE, out=self.asteroids[:num_asteroids])
+        minerals_data = np.divide(raw_minerals[:num_minerals], _MINERAL_SCALE, out=self.minerals[:num_minerals])
+        return self.ship, asteroids_data, minerals_data
+
+    def fill_tensors(self, ship, minerals, asteroids) -> Tuple["torch.Tensor", "torch.Tensor", "torch.Tensor"]:
+        """ fill as torch tensors sharing the buffers' memory. """
+        self.fill(ship, minerals, asteroids)
+        counts = (len(asteroids), len(minerals))
+        tensors = self._tensors.get(counts)
+        if tensors is None:
+            import torch
+            tensors = (torch.from_numpy(self.ship),
+                       torch.from_numpy(self.asteroids[:counts[0]]),
+                       torch.from_numpy(self.minerals[:counts[1]]))
+            self._tensors[counts] = tensors
+        return tensors
@@ -0,0 +1,114 @@
+import hashlib
+import time
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+import neat
+
+from scenario_seeds import ScenarioSeeds
+
+
+def genome_hash(genome: neat.DefaultGenome) -> bytes:
+    """
+    Digest of everything that decides how a genome plays: its nodes with
+    their bias, response, activation and aggregation, and its enabled
+    connections with their weights. Genome keys, fitness and disabled
+    connections are left out, so clones and re-created genomes hash alike.
+    """
+    nodes = sorted((key, node.bias, node.response, node.activation, node.aggregation)
+                   for key, node in genome.nodes.items())
+    connections = sorted((key, connection.weight)
+                         for key, connection in genome.connections.items() if connection.enabled)
+    # repr round-trips floats exactly
+    return hashlib.blake2b(repr((nodes, connections)).encode(), digest_size=16).digest()
+
+
+class FitnessCache:
+    """
+    Bounded LRU map from (genome_hash, scenario seeds) to fitness. A genome
+    played on a fixed seed set always gets the same fitness, so a hit is as
+    good as simulating it again. time_saved estimates the seconds the hits
+    would have cost, from the evaluation time per genome of the misses.
+    """
+    def __init__(self, max_size: int = 4096):
+        self.max_size = max_size
+        self.entries: "OrderedDict[Tuple[bytes, Tuple[int, ...]], float]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.time_saved = 0.
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups > 0 else 0.
+
+    def get(self, key: Tuple[bytes, Tuple[int, ...]]) -> Optional[float]:
+        fitness = self.entries.get(key)
+        if fitness is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return fitness
+
+    def put(self, key: Tuple[bytes, Tuple[int, ...]], fitness: float):
+        self.entries[key] = fitness
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+        self.time_saved = 0.
+
+
+class CachedEvaluator:
+    """
+    Wraps a BatchEvaluator or PersistentEvaluator that plays common scenario
+    seeds: genomes whose structure was already scored on this generation's
+    seeds get their cached fitness, only the rest reach the wrapped
+    evaluator. Without scenario_seeds every genome plays fresh random
+    scenarios and everything is passed through uncached.
+    """
+    def __init__(self, evaluator, cache: FitnessCache, scenario_seeds: Optional[ScenarioSeeds]):
+        self.evaluator = evaluator
+        self.cache = cache
+        self.scenario_seeds = scenario_seeds
+        self.seconds_per_genome = 0.
+
+    @property
+    def generation_timings(self) -> List[dict]:
+        return self.evaluator.generation_timings
+
+    def evaluate(self, genomes: List[Tuple[int, neat.DefaultGenome]], config: neat.Config):
+        if self.scenario_seeds is None:
+            self.evaluator.evaluate(genomes, config)
+            return
+        seeds = self.scenario_seeds.upcoming()
+        misses = []
+        num_hits = 0
+        for genome_id, genome in genomes:
+            fitness = self.cache.get((genome_hash(genome), seeds))
+            if fitness is None:
+                misses.append((genome_id, genome))
+            else:
+                genome.fitness = fitness
+                num_hits += 1
+        start = time.perf_counter()
+        # Always called, the wrapped evaluator moves scenario_seeds on to the next generation
+        self.evaluator.evaluate(misses, config)
+        if misses:
+            self.seconds_per_genome = (time.perf_counter() - start) / len(misses)
+        self.cache.time_saved += num_hits * self.seconds_per_genome
+        for _, genome in misses:
+            self.cache.put((genome_hash(genome), seeds), genome.fitness)
+        print("Fitness cache: {0} hits, {1} misses, {2:.1f}s saved so far".format(
+            num_hits, len(misses), self.cache.time_saved))
+
+    def close(self):
+        self.evaluator.close()
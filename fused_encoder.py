@@ -0,0 +1,188 @@
+import os
+import time
+from typing import Tuple
+
+import torch
+import torch.nn as nn
+from torch.ao.quantization import quantize_dynamic
+
+from encoder import Encoder
+from features import ASTEROID_DIM, MINERAL_DIM, SHIP_DIM
+
+# Largest absolute output difference from Encoder accepted by check_parity,
+# for the float32 fused encoder and for the int8 feed forward one
+FUSED_ATOL = 1e-4
+INT8_ATOL = 1e-1
+
+
+def _norm(h: torch.Tensor, weight: torch.Tensor, bias: torch.Tensor, eps: float) -> torch.Tensor:
+    # InstanceNorm1d over the objects of one scene, written out directly
+    mean = h.mean(dim=0, keepdim=True)
+    centered = h - mean
+    var = (centered * centered).mean(dim=0, keepdim=True)
+    return centered * torch.rsqrt(var + eps) * weight + bias
+
+
+class FusedAttentionLayer(nn.Module):
+    """ One MultiHeadAttentionLayer of GraphAttentionEncoder on a (num_objects, embed_dim) scene. """
+    def __init__(self, layer: nn.Module):
+        super().__init__()
+        skip_attention, norm1, skip_feed_forward, norm2 = layer.children()
+        attention = skip_attention.module
+        self.n_heads = attention.n_heads
+        self.key_dim = attention.key_dim
+        self.val_dim = attention.val_dim
+        self.norm_factor = attention.norm_factor
+        if self.key_dim != self.val_dim:
+            raise ValueError("Fused QKV needs key_dim == val_dim")
+        embed_dim = attention.embed_dim
+        # W_query (n_heads, input_dim, key_dim) -> rows head*key_dim + k of a Linear weight
+        qkv_weight = torch.cat([w.detach().permute(0, 2, 1).reshape(-1, attention.input_dim)
+                                for w in (attention.W_query, attention.W_key, attention.W_val)])
+        self.qkv = nn.Linear(attention.input_dim, qkv_weight.shape[0], bias=False)
+        self.qkv.weight.data.copy_(qkv_weight)
+        self.out = nn.Linear(self.n_heads * self.val_dim, embed_dim, bias=False)
+        self.out.weight.data.copy_(attention.W_out.detach().reshape(-1, embed_dim).t())
+        # The submodules were scripted along with the layer, so they are matched by their original names
+        feed_forward = list(skip_feed_forward.module.children())
+        if [getattr(m, "original_name", type(m).__name__) for m in feed_forward] != ["Linear", "ReLU", "Linear"]:
+            raise ValueError("Only the feed forward layer with a hidden layer can be fused")
+        self.ff_in = nn.Linear(feed_forward[0].in_features, feed_forward[0].out_features)
+        self.ff_in.load_state_dict(feed_forward[0].state_dict())
+        self.ff_out = nn.Linear(feed_forward[2].in_features, feed_forward[2].out_features)
+        self.ff_out.load_state_dict(feed_forward[2].state_dict())
+        self.norm1_weight = nn.Parameter(norm1.normalizer.weight.detach().clone())
+        self.norm1_bias = nn.Parameter(norm1.normalizer.bias.detach().clone())
+        self.norm2_weight = nn.Parameter(norm2.normalizer.weight.detach().clone())
+        self.norm2_bias = nn.Parameter(norm2.normalizer.bias.detach().clone())
+        self.eps = norm1.normalizer.eps
+
+    def forward(self, h: torch.Tensor) -> torch.Tensor:
+        num_objects = h.size(0)
+        qkv = self.qkv(h).view(num_objects, 3, self.n_heads, self.key_dim).permute(1, 2, 0, 3)
+        compatibility = self.norm_factor * torch.matmul(qkv[0], qkv[1].transpose(1, 2))
+        heads = torch.matmul(torch.softmax(compatibility, dim=-1), qkv[2])
+        h = h + self.out(heads.permute(1, 0, 2).reshape(num_objects, self.n_heads * self.val_dim))
+        h = _norm(h, self.norm1_weight, self.norm1_bias, self.eps)
+        h = h + self.ff_out(torch.relu(self.ff_in(h)))
+        return _norm(h, self.norm2_weight, self.norm2_bias, self.eps)
+
+
+class FusedEncoder(nn.Module):
+    """
+    Inference-only Encoder for one scene at a time, with the same call
+    signature and outputs as Encoder.forward. Attention uses one Linear for
+    the concatenated Q, K and V weights, normalisation is plain mean / var
+    arithmetic without permutes, and there is no batch dimension to carry
+    around. Build it with export_fused_encoder.
+    """
+    def __init__(self, encoder: Encoder):
+        super().__init__()
+        self.ship_fc = nn.Linear(SHIP_DIM, encoder.ship_fc.out_features, bias=False)
+        self.asteroid_fc = nn.Linear(ASTEROID_DIM, encoder.asteroid_fc.out_features, bias=False)
+        self.mineral_fc = nn.Linear(MINERAL_DIM, encoder.mineral_fc.out_features, bias=False)
+        self.obj_proj = nn.Linear(encoder.obj_proj.in_features, encoder.obj_proj.out_features, bias=False)
+        self.graph_proj = nn.Linear(encoder.graph_proj.in_features, encoder.graph_proj.out_features, bias=False)
+        for name in ("ship_fc", "asteroid_fc", "mineral_fc", "obj_proj", "graph_proj"):
+            getattr(self, name).load_state_dict(getattr(encoder, name).state_dict())
+        if encoder.gae.init_embed is not None:
+            raise ValueError("Fusing an encoder with init_embed is not supported")
+        self.layers = nn.ModuleList(FusedAttentionLayer(layer) for layer in encoder.gae.layers.children())
+
+    def forward(self,
+                ship_data: torch.Tensor,
+                asteroids_data: torch.Tensor,
+                minerals_data: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+        # The widths are ASTEROID_DIM and MINERAL_DIM, read from the layers since scripted code cannot see globals
+        h = torch.cat((self.ship_fc(ship_data.view(1, -1)),
+                       self.asteroid_fc(asteroids_data.view(-1, self.asteroid_fc.in_features)),
+                       self.mineral_fc(minerals_data.view(-1, self.mineral_fc.in_features))), dim=0)
+        for layer in self.layers:
+            h = layer(h)
+        return self.obj_proj(h), self.graph_proj(h.mean(dim=0, keepdim=True))
+
+
+def export_fused_encoder(encoder_path: str = "encoder.pth",
+                         output_path: str = "encoder_fused.pt",
+                         quantize: bool = False) -> torch.jit.ScriptModule:
+    """
+    Fold encoder.pth into a scripted FusedEncoder and save it to output_path.
+    With quantize, the feed forward Linear layers (the 32 -> 512 -> 32 bulk
+    of the weights) use int8 dynamic quantisation. The small attention and
+    embedding Linears stay float32, quantising them as well quadruples the
+    error for no further speed-up.
+    """
+    encoder = Encoder()
+    encoder.load_state_dict(torch.load(encoder_path))
+    encoder.eval()
+    fused = FusedEncoder(encoder).eval()
+    if quantize:
+        feed_forward_layers = {"layers.{0}.{1}".format(i, name) for i in range(len(fused.layers)) for name in ("ff_in", "ff_out")}
+        fused = quantize_dynamic(fused, feed_forward_layers, dtype=torch.qint8)
+    scripted = torch.jit.script(fused)
+    torch.jit.save(scripted, output_path)
+    return scripted
+
+
+def export_fused_encoder_if_stale(encoder_path: str = "encoder.pth", output_path: str = "encoder_fused.pt"):
+    """ export_fused_encoder unless output_path is already newer than encoder_path. """
+    if os.path.exists(output_path) and os.path.getmtime(output_path) >= os.path.getmtime(encoder_path):
+        return
+    print("Converting {0} to {1}".format(encoder_path, output_path))
+    export_fused_encoder(encoder_path, output_path)
+
+
+def load_fused_encoder(path: str = "encoder_fused.pt") -> torch.jit.ScriptModule:
+    fused = torch.jit.load(path)
+    fused.eval()
+    return fused
+
+
+@torch.no_grad()
+def check_parity(encoder: Encoder,
+                 fused: nn.Module,
+                 num_scenes: int = 200,
+                 atol: float = FUSED_ATOL,
+                 seed: int = 0) -> float:
+    """
+    Compare fused against encoder on random scenes of 3-8 asteroids and
+    1-5 minerals, return the largest absolute difference of any output and
+    raise a RuntimeError if it exceeds atol.
+    """
+    generator = torch.Generator().manual_seed(seed)
+    max_error = 0.
+    for _ in range(num_scenes):
+        num_asteroids = int(torch.randint(3, 9, (1,), generator=generator))
+        num_minerals = int(torch.randint(1, 6, (1,), generator=generator))
+        ship_data = torch.rand((SHIP_DIM,), generator=generator) * 2 - 1
+        asteroids_data = torch.rand((num_asteroids, ASTEROID_DIM), generator=generator)
+        minerals_data = torch.rand((num_minerals, MINERAL_DIM), generator=generator)
+        obj_embeds, graph_embeds = encoder(ship_data, asteroids_data, minerals_data)
+        fused_obj_embeds, fused_graph_embeds = fused(ship_data, asteroids_data, minerals_data)
+        max_error = max(max_error,
+                        (obj_embeds - fused_obj_embeds).abs().max().item(),
+                        (graph_embeds - fused_graph_embeds).abs().max().item())
+    if max_error > atol:
+        raise RuntimeError("Fused encoder differs from Encoder by {0:.2e} (tolerance {1:.2e})".format(max_error, atol))
+    return max_error
+
+
+@torch.no_grad()
+def _time_per_scene(module: nn.Module, num_calls: int = 2000) -> float:
+    ship_data, asteroids_data, minerals_data = torch.rand(5), torch.rand(8, 5), torch.rand(5, 2)
+    start = time.perf_counter()
+    for _ in range(num_calls):
+        module(ship_data, asteroids_data, minerals_data)
+    return (time.perf_counter() - start) / num_calls
+
+
+if __name__ == "__main__":
+    torch.set_num_threads(1)
+    encoder = Encoder()
+    encoder.load_state_dict(torch.load("encoder.pth"))
+    encoder.eval()
+    print("Encoder: {0:.1f}us per scene".format(_time_per_scene(encoder)*1e6))
+    for quantize, output_path, atol in ((False, "encoder_fused.pt", FUSED_ATOL), (True, "encoder_fused_int8.pt", INT8_ATOL)):
+        fused = export_fused_encoder("encoder.pth", output_path, quantize)
+        max_error = check_parity(encoder, fused, atol=atol)
+        print("{0}: max error {1:.2e}, {2:.1f}us per scene".format(output_path, max_error, _time_per_scene(fused)*1e6))
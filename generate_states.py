@@ -0,0 +1,191 @@
+"""
+Headless encoder training data: rolls policies out through BatchMinerEnv
+in parallel worker processes, without rendering or clock ticks, and writes
+every episode in the episode_store format that train_encoder reads.
+
+The policy is either the saved best genome or, for more diverse states,
+freshly initialised random genomes, one per episode. With action_noise
+each action is replaced by a uniformly random one with that probability.
+"""
+import os
+import pathlib
+import random
+import time
+from multiprocessing import Pool
+from typing import Dict, List, Optional, Tuple
+
+import neat
+import numpy as np
+
+from batch_simulator import BatchMinerEnv
+from checkpoint_writer import load_checkpoint
+from compiled_policy import CompiledPolicy
+from episode_store import ACTION_COLUMNS, write_episode
+
+POLICIES = ("best", "random")
+
+# Per-process state, filled once by _init_worker
+_worker_state: Dict = {}
+
+
+def _init_worker(config: neat.Config, genome_path: Optional[str]):
+    import torch
+    from utils import setup_encoder
+
+    torch.set_num_threads(1)
+    encoder = setup_encoder()
+    encoder.eval()
+    best_genome = None
+    if genome_path is not None:
+        best_genome = load_checkpoint(genome_path)
+    _worker_state.update(config=config, encoder=encoder, best_genome=best_genome)
+
+
+def _episode_genomes(policy: str, num_episodes: int, rng: random.Random) -> List[neat.DefaultGenome]:
+    config = _worker_state["config"]
+    if policy == "best":
+        return [_worker_state["best_genome"]] * num_episodes
+    # DefaultGenome.configure_new draws from the global random module
+    random.seed(rng.getrandbits(32))
+    genomes = []
+    for key in range(num_episodes):
+        genome = config.genome_type(key)
+        genome.configure_new(config.genome_config)
+        genomes.append(genome)
+    return genomes
+
+
+def rollout(policy: str,
+            seed: int,
+            num_episodes: int,
+            action_noise: float = 0.,
+            num_asteroids: Optional[int] = None) -> List[Dict[str, np.ndarray]]:
+    """
+    Play num_episodes episodes in lockstep in this worker and return their
+    columns, in write_episode's arguments, in episode order.
+    With num_asteroids None, it is drawn from 3-8 like collect_states does.
+    """
+    import torch
+
+    rng = random.Random(seed)
+    if num_asteroids is None:
+        num_asteroids = rng.randint(3, 8)
+    genomes = _episode_genomes(policy, num_episodes, rng)
+    unique_genomes = {id(genome): genome for genome in genomes}
+    genome_rows = {key: row for row, key in enumerate(unique_genomes)}
+    compiled = CompiledPolicy(list(unique_genomes.values()), _worker_state["config"])
+    genome_index = np.asarray([genome_rows[id(genome)] for genome in genomes], dtype=np.int64)
+    noise = np.random.default_rng(rng.getrandbits(32))
+    encoder = _worker_state["encoder"]
+
+    env = BatchMinerEnv([rng.getrandbits(32) for _ in range(num_episodes)], num_asteroids, move_asteroids=True)
+    episode_index = np.arange(num_episodes)
+    # One entry per tick, rows of the episodes still running at that tick
+    ticks: Dict[str, list] = {name: [] for name in ("episode", "ship", "num_asteroids", "asteroids",
+                                                    "num_minerals", "minerals", "actions")}
+    with torch.no_grad():
+        while env.num_episodes > 0:
+            ship_data, asteroids_data, minerals_data = env.observe()
+            obj_embeds, graph_embeds = encoder.forward_batch(torch.from_numpy(ship_data),
+                                                             torch.from_numpy(asteroids_data),
+                                                             torch.from_numpy(minerals_data),
+                                                             torch.from_numpy(env.num_asteroids),
+                                                             torch.from_numpy(env.num_minerals))
+            inputs = torch.cat((obj_embeds[:, 0], graph_embeds), dim=1).numpy()
+            actions = compiled.activate(inputs, genome_index[episode_index])
+            if action_noise > 0:
+                explore = noise.random(len(actions)) < action_noise
+                actions = np.where(explore[:, None], noise.random(actions.shape), actions)
+            ticks["episode"].append(episode_index)
+            ticks["ship"].append(np.stack((env.ship_x, env.ship_y, env.ship_fuel, env.ship_angle), axis=1))
+            ticks["num_asteroids"].append(env.num_asteroids.copy())
+            ticks["asteroids"].append(np.stack((env.asteroid_x, env.asteroid_y, env.asteroid_speed_x,
+                                                env.asteroid_speed_y, env.asteroid_radius), axis=2))
+            ticks["num_minerals"].append(env.num_minerals.copy())
+            ticks["minerals"].append(np.stack((env.mineral_x, env.mineral_y), axis=2))
+            # run_full mines every tick, so mine is always 1
+            ticks["actions"].append(np.concatenate((actions[:, :2], np.ones((len(actions), 1))), axis=1))
+            done = env.step(actions)
+            if done.any():
+                env.compact(~done)
+                episode_index = episode_index[~done]
+
+    columns = {name: np.concatenate(values) for name, values in ticks.items()}
+    # Group rows by episode, a stable sort keeps every episode's ticks in order
+    order = np.argsort(columns["episode"], kind="stable")
+    columns = {name: values[order] for name, values in columns.items()}
+    bounds = np.searchsorted(columns["episode"], np.arange(num_episodes + 1))
+    asteroid_valid = np.arange(columns["asteroids"].shape[1])[None, :] < columns["num_asteroids"][:, None]
+    mineral_valid = np.arange(columns["minerals"].shape[1])[None, :] < columns["num_minerals"][:, None]
+    episodes = []
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        rows = slice(start, end)
+        episodes.append({"ship": columns["ship"][rows].astype(np.float32),
+                         "asteroids": columns["asteroids"][rows][asteroid_valid[rows]].astype(np.float32),
+                         "minerals": columns["minerals"][rows][mineral_valid[rows]].astype(np.float32),
+                         "asteroid_counts": columns["num_asteroids"][rows],
+                         "mineral_counts": columns["num_minerals"][rows],
+                         "actions": columns["actions"][rows].astype(np.float32).reshape(-1, len(ACTION_COLUMNS))})
+    return episodes
+
+
+def _generate_batch(job: Tuple[str, int, int, float, pathlib.Path, int]) -> int:
+    policy, seed, num_episodes, action_noise, dataset_dir, first_episode = job
+    num_states = 0
+    for i, episode in enumerate(rollout(policy, seed, num_episodes, action_noise)):
+        write_episode(dataset_dir/"episode_{0}".format(first_episode + i), **episode)
+        num_states += len(episode["ship"])
+    return num_states
+
+
+def _next_episode_number(dataset_dir: pathlib.Path) -> int:
+    # Binary episodes and not yet converted JSON ones share the numbering
+    numbers = [int(path.name.split("_")[-1].split(".")[0]) for path in dataset_dir.glob("episode_*")]
+    return max(numbers, default=-1) + 1
+
+
+def generate_dataset(config: neat.Config,
+                     dataset_dir: pathlib.Path,
+                     num_episodes: int,
+                     policy: str = "best",
+                     genome_path: pathlib.Path = pathlib.Path("checkpoints")/"full"/"best_genome",
+                     num_workers: Optional[int] = None,
+                     episodes_per_batch: int = 64,
+                     action_noise: float = 0.1,
+                     seed: int = 0) -> int:
+    """
+    Write num_episodes new episodes to dataset_dir, numbered after the ones
+    already there, and return the number of states written. Each worker
+    job plays episodes_per_batch episodes together and writes them itself.
+    """
+    if policy not in POLICIES:
+        raise ValueError("Unknown policy: {0}".format(policy))
+    dataset_dir.mkdir(parents=True, exist_ok=True)
+    first_episode = _next_episode_number(dataset_dir)
+    rng = random.Random(seed)
+    jobs = []
+    for start in range(0, num_episodes, episodes_per_batch):
+        jobs.append((policy, rng.getrandbits(32), min(episodes_per_batch, num_episodes - start),
+                     action_noise, dataset_dir, first_episode + start))
+    start_time = time.perf_counter()
+    num_states = 0
+    pool = Pool(num_workers or os.cpu_count(),
+                initializer=_init_worker,
+                initargs=(config, str(genome_path) if policy == "best" else None))
+    try:
+        for batch_states in pool.imap_unordered(_generate_batch, jobs):
+            num_states += batch_states
+            elapsed = time.perf_counter() - start_time
+            print("{0} states in {1:.1f}s, {2:.0f} states/s".format(num_states, elapsed, num_states / elapsed))
+    finally:
+        pool.close()
+        pool.join()
+    return num_states
+
+
+if __name__ == "__main__":
+    local_dir = os.path.dirname(__file__)
+    config = neat.Config(neat.DefaultGenome, neat.DefaultReproduction,
+                         neat.DefaultSpeciesSet, neat.DefaultStagnation,
+                         os.path.join(local_dir, "neat_config.txt"))
+    generate_dataset(config, pathlib.Path()/"datasets", num_episodes=256, policy="best")
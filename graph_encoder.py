@@ -93,17 +93,15 @@ class MultiHeadAttention(torch.jit.ScriptModule):
         compatibility = self.norm_factor * torch.matmul(Q, K.transpose(2, 3))
 
         # Optionally apply mask to prevent attention
-        # if mask is not None:
-        #     mask = mask.view(1, batch_size, n_query, graph_size).expand_as(compatibility)
-        #     compatibility[mask] = -np.inf
+        if mask is not None:
+            mask = mask.view(1, batch_size, n_query, graph_size).expand_as(compatibility)
+            compatibility = compatibility.masked_fill(mask, float("-inf"))
 
         attn = torch.softmax(compatibility, dim=-1)
 
         # If there are nodes with no neighbours then softmax returns nan so we fix them to 0
-        # if mask is not None:
-        #     attnc = attn.clone()
-        #     attnc[mask] = 0
-        #     attn = attnc
+        if mask is not None:
+            attn = attn.masked_fill(mask, 0.)
 
         heads = torch.matmul(attn, V) #-> weighted average of V, 1 vektor
 
@@ -149,6 +147,22 @@ class Normalization(torch.jit.ScriptModule):
         # normed_ = normed.view(batch_size, num_items, -1)
         return self.normalizer(input.permute(0, 2, 1)).permute(0, 2, 1)
         # return normed_
+
+    @torch.jit.script_method
+    def masked_forward(self, input: torch.Tensor, mask: torch.Tensor)->torch.Tensor:
+        """
+        Instance normalization over the unmasked items only.
+
+        :param input: (batch_size, num_items, dims)
+        :param mask: (batch_size, num_items), True for padding items
+        """
+        valid = (~mask).unsqueeze(-1).to(input.dtype)
+        count = valid.sum(dim=1, keepdim=True)
+        mean = (input * valid).sum(dim=1, keepdim=True) / count
+        centered = (input - mean) * valid
+        var = (centered * centered).sum(dim=1, keepdim=True) / count
+        normed = (input - mean) / torch.sqrt(var + self.normalizer.eps)
+        return normed * self.normalizer.weight + self.normalizer.bias
         
 
 class MultiHeadAttentionLayer(nn.Sequential):
@@ -213,4 +227,25 @@ class GraphAttentionEncoder(torch.jit.ScriptModule):
             h_,  # (1, num_nodes, embed_dim)
             h_.mean(dim=1, keepdim=True),  # average to get embedding of graph, (batch_size, embed_dim)
         )
+
+    def forward_masked(self, x:torch.Tensor, mask:torch.Tensor)->Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Same as forward, for a batch of graphs padded to the same size.
+
+        :param x: (batch_size, graph_size, input_dim)
+        :param mask: (batch_size, graph_size), True for padding nodes
+        :return: node embeddings (batch_size, graph_size, embed_dim), padding rows are
+            meaningless, and graph embeddings (batch_size, 1, embed_dim) averaged over real nodes
+        """
+        h = x
+        if self.init_embed is not None:
+            h = self.init_embed(x)
+        attn_mask = mask[:, None, :].expand(-1, mask.size(1), -1)
+        for layer in self.layers.children():
+            attention, norm1, feed_forward, norm2 = layer.children()
+            h = norm1.masked_forward(h + attention.module(h, None, attn_mask), mask)
+            h = norm2.masked_forward(feed_forward(h), mask)
+        valid = (~mask).unsqueeze(-1).to(h.dtype)
+        graph_embeds = (h * valid).sum(dim=1, keepdim=True) / valid.sum(dim=1, keepdim=True)
+        return h, graph_embeds
         
\ No newline at end of file
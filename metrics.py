@@ -0,0 +1,86 @@
+import atexit
+import pathlib
+import time
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+class MetricsSink:
+    """
+    One TensorBoard SummaryWriter for the whole run, shared by the reporters.
+
+    add_scalar / add_histogram only append to a buffer; the buffer is handed
+    to the writer once it holds max_pending records or flush_secs after the
+    last flush, and on flush() and close(), so a generation's metrics cost
+    list appends rather than writer calls. The writer, and the torch import
+    it needs, is only created on the first flush. close() also runs at exit.
+    """
+    def __init__(self, log_dir: pathlib.Path, max_pending: int = 256, flush_secs: int = 30):
+        self.log_dir = log_dir
+        self.log_dir.mkdir(parents=True, exist_ok=True)
+        self.max_pending = max_pending
+        self.flush_secs = flush_secs
+        self.writer = None
+        # (kind, tag, value, step)
+        self.pending: List[Tuple[str, str, object, int]] = []
+        self.last_flush = time.monotonic()
+        atexit.register(self.close)
+
+    # Reporters are pickled with the species set they report to, so a sink
+    # pickles as its settings; buffered records stay with the live sink
+    def __getstate__(self) -> dict:
+        return {"log_dir": self.log_dir, "max_pending": self.max_pending, "flush_secs": self.flush_secs}
+
+    def __setstate__(self, state: dict):
+        self.__init__(**state)
+
+    def _append(self, record: Tuple[str, str, object, int]):
+        self.pending.append(record)
+        if len(self.pending) >= self.max_pending or time.monotonic() - self.last_flush >= self.flush_secs:
+            self.flush()
+
+    def add_scalar(self, tag: str, value: float, step: int):
+        self._append(("scalar", tag, float(value), step))
+
+    def add_scalars(self, scalars: dict, step: int):
+        for tag, value in scalars.items():
+            self.add_scalar(tag, value, step)
+
+    def add_histogram(self, tag: str, values: Sequence[float], step: int):
+        values = np.asarray(values, dtype=np.float64)
+        if len(values) == 0:
+            return
+        self._append(("histogram", tag, values, step))
+
+    def flush(self):
+        self.last_flush = time.monotonic()
+        if not self.pending:
+            return
+        if self.writer is None:
+            from torch.utils.tensorboard import SummaryWriter
+            self.writer = SummaryWriter(log_dir=str(self.log_dir.absolute()),
+                                        max_queue=self.max_pending,
+                                        flush_secs=self.flush_secs)
+        for kind, tag, value, step in self.pending:
+            if kind == "scalar":
+                self.writer.add_scalar(tag, value, step)
+            else:
+                self.writer.add_histogram(tag, value, step)
+        self.pending.clear()
+        self.writer.flush()
+
+    def close(self):
+        self.flush()
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+        atexit.unregister(self.close)
+
+
+def throughput(timings: Optional[dict]) -> dict:
+    """ Episodes/s and ticks/s of one evaluator generation_timings entry, {} if it has no counts. """
+    if not timings or timings.get("wall", 0.) <= 0 or "episodes" not in timings:
+        return {}
+    return {"Episodes per Second": timings["episodes"] / timings["wall"],
+            "Ticks per Second": timings.get("ticks", 0) / timings["wall"]}
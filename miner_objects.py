@@ -1,11 +1,15 @@
+from __future__ import annotations
+
 import math
 import os
 import random
 import time
-from typing import List, Optional, Tuple, Union
+from typing import TYPE_CHECKING, List, Optional, Tuple, Union
 
-import pygame
-from pygame.surface import Surface
+if TYPE_CHECKING:
+    # pygame is only imported by the draw methods, headless runs never load it
+    from pygame.surface import Surface
+    from spatial_hash import SpatialHash
 
 WIDTH, HEIGHT, DIAG = 800, 600, 1000
 # Colors
@@ -15,48 +19,78 @@ RED = (255, 0, 0)
 GREEN = (0, 255, 0)
 BLUE = (0, 0, 255)
 YELLOW = (255, 255, 0)
+# Object parameters
+SHIP_SPEED = 5
+SHIP_RADIUS = 15
+MAX_FUEL = 100.0
+FUEL_PER_MOVE = 0.1
+FUEL_PER_MINERAL = 10
+MINERAL_RADIUS = 10
+MINERAL_MARGIN = 20
+ASTEROID_MIN_RADIUS, ASTEROID_MAX_RADIUS = 15, 30
+ASTEROID_MAX_SPEED = 2
+# Episode parameters
+NUM_ASTEROIDS = 8
+NUM_MINERALS = 5
+MIN_MINERALS = 2
+MAX_IDLE_TIME = 300
+MAX_EPISODE_TIME = 5000
+IDLE_PENALTY = 0.2
+MINERAL_REWARD = 20
+TERMINAL_PENALTY = 500
 
 # Game Classes (same as before)
+# Mineral and Asteroid draw their placement from rng, a random.Random, when
+# one is given and from the global random module otherwise
 class Mineral:
-    def __init__(self, screen:Optional[Surface]):
-        self.x = random.randint(20, WIDTH - 20)
-        self.y = random.randint(20, HEIGHT - 20)
-        self.radius = 10
+    def __init__(self, screen:Optional[Surface], rng:Optional[random.Random]=None):
+        rng = random if rng is None else rng
+        self.x = rng.randint(MINERAL_MARGIN, WIDTH - MINERAL_MARGIN)
+        self.y = rng.randint(MINERAL_MARGIN, HEIGHT - MINERAL_MARGIN)
+        self.radius = MINERAL_RADIUS
         self.screen: Optional[Surface] = screen
 
     def draw(self):
+        import pygame
         pygame.draw.circle(self.screen, YELLOW, (self.x, self.y), self.radius)
 
 class Spaceship:
     def __init__(self, screen:Surface):
         self.x = WIDTH // 2
         self.y = HEIGHT // 2
-        self.speed = 5
+        self.speed = SHIP_SPEED
         self.angle = 0
-        self.fuel = 100.0
+        self.fuel = MAX_FUEL
         self.minerals = 0
-        self.radius = 15
+        self.radius = SHIP_RADIUS
         self.screen:Surface = screen
 
     def move(self, dx:int, dy:int):
         if self.fuel > 0:
             self.x = (self.x + dx) % WIDTH
             self.y = (self.y + dy) % HEIGHT
-            self.fuel -= 0.1
+            self.fuel -= FUEL_PER_MOVE
 
-    def mine(self, minerals:List[Mineral])->int:
+    def mine(self, minerals:List[Mineral], index:Optional["SpatialHash"]=None)->int:
+        """ Mine every mineral touching the ship. index, if given, is a SpatialHash of minerals kept in sync. """
+        if index is None:
+            candidates = [mineral for mineral in minerals
+                          if math.hypot(self.x - mineral.x, self.y - mineral.y) < self.radius + mineral.radius]
+        else:
+            candidates = index.query_circle(self.x, self.y, self.radius)
         num_minerals_mined = 0
-        for mineral in minerals[:]:
-            dist = math.hypot(self.x - mineral.x, self.y - mineral.y)
-            if dist < self.radius + mineral.radius:
-                minerals.remove(mineral)
-                self.minerals += 1
-                num_minerals_mined += 1
-                self.fuel = min(100, self.fuel + 10)
+        for mineral in candidates:
+            minerals.remove(mineral)
+            if index is not None:
+                index.remove(mineral)
+            self.minerals += 1
+            num_minerals_mined += 1
+            self.fuel = min(MAX_FUEL, self.fuel + FUEL_PER_MINERAL)
         return num_minerals_mined
     
     
     def draw(self):
+        import pygame
         pygame.draw.circle(self.screen, BLUE, (int(self.x), int(self.y)), self.radius)
         points = [
             (self.x + self.radius * math.cos(self.angle), 
@@ -70,12 +104,13 @@ class Spaceship:
 
 
 class Asteroid:
-    def __init__(self, screen:Optional[Surface]=None):
-        self.x = random.randint(0, WIDTH)
-        self.y = random.randint(0, HEIGHT)
-        self.radius = random.randint(15, 30)
-        self.speed_x = random.uniform(-2, 2)
-        self.speed_y = random.uniform(-2, 2)
+    def __init__(self, screen:Optional[Surface]=None, rng:Optional[random.Random]=None):
+        rng = random if rng is None else rng
+        self.x = rng.randint(0, WIDTH)
+        self.y = rng.randint(0, HEIGHT)
+        self.radius = rng.randint(ASTEROID_MIN_RADIUS, ASTEROID_MAX_RADIUS)
+        self.speed_x = rng.uniform(-ASTEROID_MAX_SPEED, ASTEROID_MAX_SPEED)
+        self.speed_y = rng.uniform(-ASTEROID_MAX_SPEED, ASTEROID_MAX_SPEED)
         self.screen:Optional[Surface] = screen
 
     def move(self):
@@ -83,4 +118,5 @@ class Asteroid:
         self.y = (self.y + self.speed_y) % HEIGHT
 
     def draw(self):
+        import pygame
         pygame.draw.circle(self.screen, RED, (int(self.x), int(self.y)), self.radius)
\ No newline at end of file
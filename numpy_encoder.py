@@ -0,0 +1,107 @@
+"""
+Torch-free inference backend for Encoder.
+
+export_npz converts the encoder.pth state dict into encoder.npz once, and
+NumpyEncoder runs Encoder.forward on one scene with NumPy only, so
+evaluation workers that use it never import torch. Importing this module
+does not import torch either; only export_npz does.
+"""
+import os
+from typing import Dict, Tuple
+
+import numpy as np
+
+from features import ASTEROID_DIM, MINERAL_DIM
+
+# InstanceNorm1d's default, used by graph_encoder.Normalization
+NORM_EPS = 1e-5
+
+
+def export_npz(encoder_path: str = "encoder.pth", output_path: str = "encoder.npz"):
+    """ Convert an Encoder state dict into the flat float32 arrays NumpyEncoder loads. """
+    import torch
+
+    state_dict = {key: value.detach().cpu().numpy().astype(np.float32) for key, value in torch.load(encoder_path).items()}
+    arrays: Dict[str, np.ndarray] = {
+        "ship_fc": state_dict["ship_fc.weight"].T,
+        "asteroid_fc": state_dict["asteroid_fc.weight"].T,
+        "mineral_fc": state_dict["mineral_fc.weight"].T,
+        "obj_proj": state_dict["obj_proj.weight"].T,
+        "graph_proj": state_dict["graph_proj.weight"].T,
+    }
+    num_layers = 0
+    while "gae.layers.{0}.0.module.W_query".format(num_layers) in state_dict:
+        prefix = "gae.layers.{0}.".format(num_layers)
+        w_query, w_key, w_val = (state_dict[prefix + "0.module." + name] for name in ("W_query", "W_key", "W_val"))
+        n_heads, input_dim, key_dim = w_query.shape
+        # (input_dim, 3*n_heads*key_dim), columns ordered query/key/value, then head, then key_dim
+        arrays["layer{0}.qkv".format(num_layers)] = np.concatenate(
+            [w.transpose(1, 0, 2).reshape(input_dim, n_heads * key_dim) for w in (w_query, w_key, w_val)], axis=1)
+        arrays["layer{0}.out".format(num_layers)] = state_dict[prefix + "0.module.W_out"].reshape(n_heads * key_dim, -1)
+        arrays["layer{0}.norm1_weight".format(num_layers)] = state_dict[prefix + "1.normalizer.weight"]
+        arrays["layer{0}.norm1_bias".format(num_layers)] = state_dict[prefix + "1.normalizer.bias"]
+        arrays["layer{0}.ff_in".format(num_layers)] = state_dict[prefix + "2.module.0.weight"].T
+        arrays["layer{0}.ff_in_bias".format(num_layers)] = state_dict[prefix + "2.module.0.bias"]
+        arrays["layer{0}.ff_out".format(num_layers)] = state_dict[prefix + "2.module.2.weight"].T
+        arrays["layer{0}.ff_out_bias".format(num_layers)] = state_dict[prefix + "2.module.2.bias"]
+        arrays["layer{0}.norm2_weight".format(num_layers)] = state_dict[prefix + "3.normalizer.weight"]
+        arrays["layer{0}.norm2_bias".format(num_layers)] = state_dict[prefix + "3.normalizer.bias"]
+        num_layers += 1
+    arrays["n_heads"] = np.asarray(n_heads)
+    arrays["num_layers"] = np.asarray(num_layers)
+    np.savez(output_path, **{key: np.ascontiguousarray(value) for key, value in arrays.items()})
+
+
+def export_npz_if_stale(encoder_path: str = "encoder.pth", output_path: str = "encoder.npz"):
+    """ export_npz unless output_path is already newer than encoder_path. """
+    if os.path.exists(output_path) and os.path.getmtime(output_path) >= os.path.getmtime(encoder_path):
+        return
+    print("Converting {0} to {1}".format(encoder_path, output_path))
+    export_npz(encoder_path, output_path)
+
+
+def _norm(h: np.ndarray, weight: np.ndarray, bias: np.ndarray) -> np.ndarray:
+    centered = h - h.mean(axis=0, keepdims=True)
+    var = (centered * centered).mean(axis=0, keepdims=True)
+    return centered / np.sqrt(var + NORM_EPS) * weight + bias
+
+
+class NumpyEncoder:
+    """
+    Encoder.forward for one scene in float32 NumPy, from the arrays written
+    by export_npz. Takes the NumPy feature arrays of
+    features.ObservationBuffer.fill and returns obj_embeds (num_objects, 8)
+    and graph_embeds (1, 8), matching Encoder up to float32 rounding.
+    """
+    def __init__(self, path: str = "encoder.npz"):
+        with np.load(path) as arrays:
+            self.arrays = {key: arrays[key] for key in arrays.files}
+        self.n_heads = self.arrays["n_heads"].item()
+        self.layers = [{name: self.arrays["layer{0}.{1}".format(i, name)]
+                        for name in ("qkv", "out", "norm1_weight", "norm1_bias", "ff_in", "ff_in_bias",
+                                     "ff_out", "ff_out_bias", "norm2_weight", "norm2_bias")}
+                       for i in range(self.arrays["num_layers"].item())]
+        self.key_dim = self.layers[0]["qkv"].shape[1] // (3 * self.n_heads)
+        self.norm_factor = np.float32(1 / np.sqrt(self.key_dim))
+
+    def eval(self) -> "NumpyEncoder":
+        return self
+
+    def __call__(self,
+                 ship_data: np.ndarray,
+                 asteroids_data: np.ndarray,
+                 minerals_data: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        h = np.concatenate((ship_data.reshape(1, -1) @ self.arrays["ship_fc"],
+                            asteroids_data.reshape(-1, ASTEROID_DIM) @ self.arrays["asteroid_fc"],
+                            minerals_data.reshape(-1, MINERAL_DIM) @ self.arrays["mineral_fc"]))
+        num_objects = len(h)
+        for layer in self.layers:
+            queries, keys, values = (h @ layer["qkv"]).reshape(num_objects, 3, self.n_heads, self.key_dim).transpose(1, 2, 0, 3)
+            compatibility = self.norm_factor * (queries @ keys.transpose(0, 2, 1))
+            attention = np.exp(compatibility - compatibility.max(axis=-1, keepdims=True))
+            attention /= attention.sum(axis=-1, keepdims=True)
+            heads = (attention @ values).transpose(1, 0, 2).reshape(num_objects, -1)
+            h = _norm(h + heads @ layer["out"], layer["norm1_weight"], layer["norm1_bias"])
+            hidden = np.maximum(h @ layer["ff_in"] + layer["ff_in_bias"], 0)
+            h = _norm(h + hidden @ layer["ff_out"] + layer["ff_out_bias"], layer["norm2_weight"], layer["norm2_bias"])
+        return h @ self.arrays["obj_proj"], h.mean(axis=0, keepdims=True) @ self.arrays["graph_proj"]
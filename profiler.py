@@ -0,0 +1,54 @@
+import time
+from typing import Dict, List, Tuple
+
+# Key prefixes of the phase entries in a timings dict
+PHASE_PREFIX = "phase/"
+CALLS_PREFIX = "calls/"
+
+
+class PhaseProfiler:
+    """
+    Cumulative seconds and call counts per phase of a loop body.
+
+    Call start() at the top of the loop and lap(phase) after each phase:
+    the time since the previous start() / lap() is charged to phase, so one
+    perf_counter call per phase is the whole overhead. add_to() merges the
+    totals into a timings dict as "phase/<name>" seconds and "calls/<name>"
+    counts, which the evaluators sum across genomes and worker processes
+    like their other timings entries.
+    """
+    def __init__(self):
+        self.seconds: Dict[str, float] = {}
+        self.calls: Dict[str, int] = {}
+        self.last = time.perf_counter()
+
+    def start(self):
+        self.last = time.perf_counter()
+
+    def lap(self, phase: str):
+        now = time.perf_counter()
+        self.seconds[phase] = self.seconds.get(phase, 0.) + now - self.last
+        self.calls[phase] = self.calls.get(phase, 0) + 1
+        self.last = now
+
+    def add_to(self, timings: Dict[str, float]):
+        for phase, seconds in self.seconds.items():
+            timings[PHASE_PREFIX + phase] = timings.get(PHASE_PREFIX + phase, 0.) + seconds
+            timings[CALLS_PREFIX + phase] = timings.get(CALLS_PREFIX + phase, 0) + self.calls[phase]
+
+
+def phase_totals(timings: Dict[str, float]) -> List[Tuple[str, float, int]]:
+    """ (phase, seconds, calls) of a timings dict, slowest first. """
+    phases = [(key[len(PHASE_PREFIX):], seconds, int(timings.get(CALLS_PREFIX + key[len(PHASE_PREFIX):], 0)))
+              for key, seconds in timings.items() if key.startswith(PHASE_PREFIX)]
+    return sorted(phases, key=lambda phase: -phase[1])
+
+
+def format_phases(timings: Dict[str, float]) -> str:
+    phases = phase_totals(timings)
+    total = sum(seconds for _, seconds, _ in phases)
+    lines = ["{0:<12} {1:>9} {2:>7} {3:>10} {4:>10}".format("phase", "seconds", "share", "calls", "us/call")]
+    for phase, seconds, calls in phases:
+        lines.append("{0:<12} {1:>9.3f} {2:>7.1%} {3:>10} {4:>10.1f}".format(
+            phase, seconds, seconds / total if total > 0 else 0., calls, seconds / calls * 1e6 if calls else 0.))
+    return "\n".join(lines)
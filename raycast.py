@@ -0,0 +1,195 @@
+import math
+from typing import List, Union
+
+import numba as nb
+import numpy as np
+
+from miner_objects import DIAG, HEIGHT, MINERAL_RADIUS, WIDTH, Asteroid, Mineral
+
+NO_HIT = -9999.0
+
+
+@nb.njit(cache=True)
+def ray_circle_intersect(ox:float,
+                         oy:float,
+                         dx:float,
+                         dy:float,
+                         cx:float,
+                         cy:float,
+                         r:float)->float:
+    # 1. Compute quadratic coefficients
+    fx = ox - cx
+    fy = oy - cy
+    a = 1  # dx*dx + dy*dy, assuming (dx,dy) normalized
+    b = 2 * (fx * dx + fy * dy)
+    c = fx*fx + fy*fy - r*r
+
+    # 2. Discriminant
+    disc = b*b - 4*a*c
+    if disc < 0:
+        return NO_HIT   # no intersection
+
+    # 3. Two possible solutions, t1 <= t2
+    sqrt_disc = math.sqrt(disc)
+    t1 = (-b - sqrt_disc) / (2*a)
+    t2 = (-b + sqrt_disc) / (2*a)
+
+    # 4. Choose nearest forward hit
+    if t1 >= 0:
+        return t1
+    if t2 >= 0:
+        return t2
+    return NO_HIT
+
+
+@nb.njit(cache=True)
+def _cast_one_ray(ox: float,
+                  oy: float,
+                  angle: float,
+                  obj_x: np.ndarray,
+                  obj_y: np.ndarray,
+                  obj_radius: np.ndarray,
+                  obj_flags: np.ndarray,
+                  max_length: float,
+                  wrap: bool,
+                  width: float,
+                  height: float):
+    dx, dy = math.cos(angle), math.sin(angle)
+    # Images of the world the ray can reach when wrapping around the edges
+    num_x_images = int(max_length // width) + 1 if wrap else 0
+    num_y_images = int(max_length // height) + 1 if wrap else 0
+    closest_t = NO_HIT
+    closest_flag = 0.
+    for i in range(obj_x.shape[0]):
+        if obj_flags[i] == 0:
+            continue  # empty slot
+        for ix in range(-num_x_images, num_x_images + 1):
+            for iy in range(-num_y_images, num_y_images + 1):
+                t = ray_circle_intersect(ox, oy, dx, dy,
+                                         obj_x[i] + ix * width, obj_y[i] + iy * height, obj_radius[i])
+                if t < 0 or t > max_length:
+                    continue
+                if closest_t < 0 or t < closest_t:
+                    closest_t = t
+                    closest_flag = obj_flags[i]
+    if closest_t < 0:
+        return 1.0, 0.
+    return min(1.0, closest_t / max_length), closest_flag
+
+
+@nb.njit(cache=True, parallel=True)
+def cast_rays_nb(ship_x: float,
+                 ship_y: float,
+                 ship_angle: float,
+                 num_rays:int,
+                 object_coords:np.ndarray,
+                 obj_radius: np.ndarray,
+                 obj_flags: np.ndarray,
+                 max_length:float,
+                 dist_flag_arr:np.ndarray,
+                 wrap: bool = False,
+                 width: float = WIDTH,
+                 height: float = HEIGHT)->np.ndarray:
+    """
+    num_rays evenly spaced rays around one ship, starting at ship_angle.
+    dist_flag_arr (num_rays*2,) receives, per ray, the distance to the first
+    hit normalised by max_length (1.0 if nothing is hit within max_length)
+    and the flag of the object hit (+1 mineral, -1 asteroid, 0 nothing).
+    Objects with flag 0 are skipped, so buffers can be padded.
+    """
+    for ri in nb.prange(num_rays):
+        angle = ship_angle + ri * (math.pi/(num_rays/2))
+        norm_dist, flag = _cast_one_ray(ship_x, ship_y, angle,
+                                        object_coords[:, 0], object_coords[:, 1], obj_radius, obj_flags,
+                                        max_length, wrap, width, height)
+        dist_flag_arr[ri*2] = norm_dist
+        dist_flag_arr[ri*2+1] = flag
+    return dist_flag_arr
+
+
+@nb.njit(cache=True, parallel=True)
+def cast_rays_batch_nb(ship_x: np.ndarray,
+                       ship_y: np.ndarray,
+                       ship_angle: np.ndarray,
+                       obj_x: np.ndarray,
+                       obj_y: np.ndarray,
+                       obj_radius: np.ndarray,
+                       obj_flags: np.ndarray,
+                       max_length: float,
+                       wrap: bool,
+                       width: float,
+                       height: float,
+                       dist_flag_arr: np.ndarray) -> np.ndarray:
+    """
+    cast_rays_nb for many ships, each with its own objects: ship arrays are
+    (num_ships,), object arrays (num_ships, max_objects) padded with flag 0,
+    and dist_flag_arr (num_ships, num_rays*2). Parallel over ships x rays.
+    """
+    num_ships = ship_x.shape[0]
+    num_rays = dist_flag_arr.shape[1] // 2
+    for job in nb.prange(num_ships * num_rays):
+        si = job // num_rays
+        ri = job % num_rays
+        angle = ship_angle[si] + ri * (math.pi/(num_rays/2))
+        norm_dist, flag = _cast_one_ray(ship_x[si], ship_y[si], angle,
+                                        obj_x[si], obj_y[si], obj_radius[si], obj_flags[si],
+                                        max_length, wrap, width, height)
+        dist_flag_arr[si, ri*2] = norm_dist
+        dist_flag_arr[si, ri*2+1] = flag
+    return dist_flag_arr
+
+
+class RaySensor:
+    """
+    Preallocated structure-of-arrays buffers for cast_rays_batch_nb.
+
+    Object slots are filled in place, from object lists with set_objects or
+    from a BatchMinerEnv with set_from_env, and cast writes into the reused
+    out buffer, so steady-state sensing allocates nothing.
+    """
+    def __init__(self,
+                 num_rays: int,
+                 max_objects: int,
+                 num_ships: int = 1,
+                 max_length: float = DIAG,
+                 wrap: bool = False):
+        self.num_rays = num_rays
+        self.max_length = max_length
+        self.wrap = wrap
+        self.obj_x = np.zeros((num_ships, max_objects), dtype=np.float64)
+        self.obj_y = np.zeros((num_ships, max_objects), dtype=np.float64)
+        self.obj_radius = np.zeros((num_ships, max_objects), dtype=np.float64)
+        self.obj_flags = np.zeros((num_ships, max_objects), dtype=np.float64)
+        self.out = np.empty((num_ships, num_rays*2), dtype=np.float64)
+
+    def set_objects(self, ship_index: int, objects: List[Union[Mineral, Asteroid]]):
+        self.obj_flags[ship_index] = 0.
+        for i, obj in enumerate(objects):
+            self.obj_x[ship_index, i] = obj.x
+            self.obj_y[ship_index, i] = obj.y
+            self.obj_radius[ship_index, i] = obj.radius
+            self.obj_flags[ship_index, i] = 1. if isinstance(obj, Mineral) else -1.
+
+    def set_from_env(self, env):
+        """ Copy the asteroids and minerals of every episode of a BatchMinerEnv into the slots. """
+        n = env.num_episodes
+        num_asteroid_slots = env.asteroid_x.shape[1]
+        asteroids = slice(0, num_asteroid_slots)
+        minerals = slice(num_asteroid_slots, num_asteroid_slots + env.mineral_x.shape[1])
+        self.obj_x[:n, asteroids] = env.asteroid_x
+        self.obj_y[:n, asteroids] = env.asteroid_y
+        self.obj_radius[:n, asteroids] = env.asteroid_radius
+        self.obj_flags[:n, asteroids] = np.where(np.arange(num_asteroid_slots) < env.num_asteroids[:, None], -1., 0.)
+        self.obj_x[:n, minerals] = env.mineral_x
+        self.obj_y[:n, minerals] = env.mineral_y
+        self.obj_radius[:n, minerals] = MINERAL_RADIUS
+        self.obj_flags[:n, minerals] = np.where(np.arange(env.mineral_x.shape[1]) < env.num_minerals[:, None], 1., 0.)
+
+    def cast(self, ship_x: np.ndarray, ship_y: np.ndarray, ship_angle: np.ndarray) -> np.ndarray:
+        """ Ray readings (num_ships, num_rays*2) for the first len(ship_x) ships. """
+        n = len(ship_x)
+        return cast_rays_batch_nb(np.asarray(ship_x, dtype=np.float64),
+                                  np.asarray(ship_y, dtype=np.float64),
+                                  np.asarray(ship_angle, dtype=np.float64),
+                                  self.obj_x[:n], self.obj_y[:n], self.obj_radius[:n], self.obj_flags[:n],
+                                  self.max_length, self.wrap, WIDTH, HEIGHT, self.out[:n])
@@ -0,0 +1,48 @@
+import random
+from typing import Optional, Tuple
+
+import neat
+
+
+class ScenarioSeeds:
+    """
+    Common random numbers for evaluation: every genome of a generation plays
+    the same num_samples scenario seeds, so fitness differences come from the
+    genomes rather than from the scenarios they happened to draw.
+
+    The seed set is drawn from base_seed and kept for refresh_interval
+    generations (0 keeps one set for the whole run). A genome that was
+    already scored on the current set, typically an elite carried over by
+    the reproduction, keeps its fitness instead of being evaluated again.
+    """
+    def __init__(self, num_samples: int = 3, base_seed: int = 0, refresh_interval: int = 0):
+        self.num_samples = num_samples
+        self.refresh_interval = refresh_interval
+        self.rng = random.Random(base_seed)
+        self.generation = 0
+        self.seeds: Tuple[int, ...] = ()
+        self._upcoming: Optional[Tuple[int, ...]] = None
+
+    def upcoming(self) -> Tuple[int, ...]:
+        """ Seeds the next call to next_generation will return, without moving on. """
+        if self._upcoming is None:
+            if not self.seeds or (self.refresh_interval > 0 and self.generation % self.refresh_interval == 0):
+                self._upcoming = tuple(self.rng.getrandbits(32) for _ in range(self.num_samples))
+            else:
+                self._upcoming = self.seeds
+        return self._upcoming
+
+    def next_generation(self) -> Tuple[int, ...]:
+        """ Seeds of the generation about to be evaluated. """
+        self.seeds = self.upcoming()
+        self._upcoming = None
+        self.generation += 1
+        return self.seeds
+
+    @staticmethod
+    def already_evaluated(genome: neat.DefaultGenome, seeds: Optional[Tuple[int, ...]]) -> bool:
+        return seeds is not None and genome.fitness is not None and getattr(genome, "evaluated_seeds", None) == seeds
+
+    @staticmethod
+    def mark_evaluated(genome: neat.DefaultGenome, seeds: Optional[Tuple[int, ...]]):
+        genome.evaluated_seeds = seeds
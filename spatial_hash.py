@@ -0,0 +1,191 @@
+import math
+from typing import Dict, Hashable, List, Optional, Tuple
+
+from miner_objects import HEIGHT, WIDTH
+
+Cell = Tuple[int, int]
+
+
+class SpatialHash:
+    """
+    Uniform-grid broad phase over the wrap-around WIDTH x HEIGHT world.
+
+    The world is split into num_cols x num_rows cells and every circle is
+    registered in each cell its bounding box overlaps, with cell indices
+    wrapped around the world edges. Objects are keyed by any hashable, e.g.
+    the Asteroid / Mineral instances themselves, and are kept up to date with
+    insert / move / remove as they spawn, move, get mined or respawn.
+
+    Queries take a wrap flag. With wrap=True distances are measured on the
+    torus (nearest image); with wrap=False they are plain euclidean distances,
+    which is what run_full uses for mining and collisions.
+    """
+    def __init__(self,
+                 num_cols: int = 16,
+                 num_rows: int = 12,
+                 width: float = WIDTH,
+                 height: float = HEIGHT):
+        self.num_cols = num_cols
+        self.num_rows = num_rows
+        self.width = width
+        self.height = height
+        self.cell_width = width / num_cols
+        self.cell_height = height / num_rows
+        self.cells: Dict[Cell, Dict[Hashable, None]] = {}
+        # key -> (x, y, radius, cells)
+        self.objects: Dict[Hashable, Tuple[float, float, float, Tuple[Cell, ...]]] = {}
+        self.max_radius = 0.
+
+    def __len__(self) -> int:
+        return len(self.objects)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self.objects
+
+    def _cells_overlapping(self, x: float, y: float, radius: float) -> Tuple[Cell, ...]:
+        col_start = math.floor((x - radius) / self.cell_width)
+        col_end = math.floor((x + radius) / self.cell_width)
+        row_start = math.floor((y - radius) / self.cell_height)
+        row_end = math.floor((y + radius) / self.cell_height)
+        cols = {c % self.num_cols for c in range(col_start, min(col_end, col_start + self.num_cols - 1) + 1)}
+        rows = {r % self.num_rows for r in range(row_start, min(row_end, row_start + self.num_rows - 1) + 1)}
+        return tuple((c, r) for c in cols for r in rows)
+
+    def insert(self, key: Hashable, x: float, y: float, radius: float):
+        if key in self.objects:
+            self.remove(key)
+        cells = self._cells_overlapping(x, y, radius)
+        for cell in cells:
+            self.cells.setdefault(cell, {})[key] = None
+        self.objects[key] = (x, y, radius, cells)
+        self.max_radius = max(self.max_radius, radius)
+
+    def remove(self, key: Hashable):
+        _, _, _, cells = self.objects.pop(key)
+        for cell in cells:
+            bucket = self.cells[cell]
+            del bucket[key]
+            if not bucket:
+                del self.cells[cell]
+
+    def move(self, key: Hashable, x: float, y: float):
+        """ Update the position of key, touching the grid only if it changed cells. """
+        _, _, radius, cells = self.objects[key]
+        new_cells = self._cells_overlapping(x, y, radius)
+        if new_cells != cells:
+            self.insert(key, x, y, radius)
+        else:
+            self.objects[key] = (x, y, radius, cells)
+
+    def _offset(self, dx: float, dy: float, wrap: bool) -> Tuple[float, float]:
+        if wrap:
+            dx -= self.width * round(dx / self.width)
+            dy -= self.height * round(dy / self.height)
+        return dx, dy
+
+    def query_circle(self, x: float, y: float, radius: float, wrap: bool = False) -> List[Hashable]:
+        """ Keys of the objects overlapping the circle (x, y, radius), i.e. dist < radius + object radius. """
+        hits = {}
+        for cell in self._cells_overlapping(x, y, radius + self.max_radius):
+            for key in self.cells.get(cell, ()):
+                if key in hits:
+                    continue
+                ox, oy, oradius, _ = self.objects[key]
+                dx, dy = self._offset(ox - x, oy - y, wrap)
+                hits[key] = math.hypot(dx, dy) < radius + oradius
+        return [key for key, hit in hits.items() if hit]
+
+    def nearest(self, x: float, y: float, max_distance: float, wrap: bool = False) -> Tuple[Optional[Hashable], float]:
+        """ Key and centre distance of the closest object whose centre is within max_distance, or (None, inf). """
+        best_key, best_dist = None, math.inf
+        for cell in self._cells_overlapping(x, y, max_distance):
+            for key in self.cells.get(cell, ()):
+                ox, oy, _, _ = self.objects[key]
+                dx, dy = self._offset(ox - x, oy - y, wrap)
+                dist = math.hypot(dx, dy)
+                if dist <= max_distance and dist < best_dist:
+                    best_key, best_dist = key, dist
+        return best_key, best_dist
+
+    def cast_ray(self,
+                 ox: float,
+                 oy: float,
+                 angle: float,
+                 max_length: float,
+                 wrap: bool = False) -> Tuple[Optional[Hashable], float]:
+        """
+        Nearest object hit by the ray from (ox, oy) along angle within
+        max_length, walking the grid cell by cell (DDA) and stopping at the
+        first cell that contains a hit. Returns (key, distance) or (None, inf).
+        """
+        dx, dy = math.cos(angle), math.sin(angle)
+        col = math.floor(ox / self.cell_width)
+        row = math.floor(oy / self.cell_height)
+        step_col = 1 if dx > 0 else -1
+        step_row = 1 if dy > 0 else -1
+        # Ray length at which the next column / row boundary is crossed, and between boundaries
+        next_col_t = ((col + (step_col > 0)) * self.cell_width - ox) / dx if dx != 0 else math.inf
+        next_row_t = ((row + (step_row > 0)) * self.cell_height - oy) / dy if dy != 0 else math.inf
+        col_t = self.cell_width / abs(dx) if dx != 0 else math.inf
+        row_t = self.cell_height / abs(dy) if dy != 0 else math.inf
+
+        tested = set()
+        best_key, best_t = None, math.inf
+        cell_start_t = 0.
+        while cell_start_t <= max_length:
+            # Circles near an edge poke out of the world, so without wrap the
+            # walk goes on until it is further than max_radius outside
+            in_reach = (-self.max_radius < (col + 1) * self.cell_width and col * self.cell_width < self.width + self.max_radius
+                        and -self.max_radius < (row + 1) * self.cell_height and row * self.cell_height < self.height + self.max_radius)
+            if wrap or in_reach:
+                cell_cx = (col + 0.5) * self.cell_width
+                cell_cy = (row + 0.5) * self.cell_height
+                for key in self.cells.get((col % self.num_cols, row % self.num_rows), ()):
+                    if key in tested:
+                        continue
+                    tested.add(key)
+                    cx, cy, radius, _ = self.objects[key]
+                    if wrap:
+                        # Image of the object closest to this (unwrapped) cell
+                        cx += self.width * round((cell_cx - cx) / self.width)
+                        cy += self.height * round((cell_cy - cy) / self.height)
+                    t = _ray_circle_distance(ox, oy, dx, dy, cx, cy, radius)
+                    if t is not None and t < best_t:
+                        best_key, best_t = key, t
+            elif not wrap and cell_start_t > 0:
+                break
+            cell_end_t = min(next_col_t, next_row_t)
+            if best_t <= cell_end_t:
+                break
+            if wrap:
+                # Images seen from another tile are different objects along the ray
+                tested.clear()
+            cell_start_t = cell_end_t
+            if next_col_t < next_row_t:
+                col += step_col
+                next_col_t += col_t
+            else:
+                row += step_row
+                next_row_t += row_t
+        if best_t > max_length:
+            return None, math.inf
+        return best_key, best_t
+
+
+def _ray_circle_distance(ox: float, oy: float, dx: float, dy: float,
+                         cx: float, cy: float, radius: float) -> Optional[float]:
+    """ Distance along the unit ray to its first forward intersection with the circle, or None. """
+    fx, fy = ox - cx, oy - cy
+    b = 2 * (fx * dx + fy * dy)
+    c = fx * fx + fy * fy - radius * radius
+    disc = b * b - 4 * c
+    if disc < 0:
+        return None
+    sqrt_disc = math.sqrt(disc)
+    t1 = (-b - sqrt_disc) / 2
+    t2 = (-b + sqrt_disc) / 2
+    if t1 >= 0:
+        return t1
+    if t2 >= 0:
+        return t2
+    return None
@@ -0,0 +1,36 @@
+"""
+History retention of CheckpointWriter. Run with python -m pytest from the
+repo root.
+"""
+from checkpoint_writer import CheckpointWriter, load_checkpoint
+
+
+def _history_generations(directory, name: str):
+    return sorted(int(path.name[len(name) + 1:]) for path in directory.glob(name + "-*")
+                  if path.name[len(name) + 1:].isdigit())
+
+
+def test_history_keeps_newest_generations(tmp_path):
+    writer = CheckpointWriter(tmp_path, history=3)
+    for generation in range(6):
+        writer.save("checkpoint", generation, generation)
+    writer.close()
+    assert _history_generations(tmp_path, "checkpoint") == [3, 4, 5]
+    assert load_checkpoint(tmp_path/"checkpoint") == 5
+
+
+def test_history_prunes_files_of_earlier_runs(tmp_path):
+    writer = CheckpointWriter(tmp_path, history=5)
+    for generation in range(12):
+        writer.save("checkpoint", generation, generation)
+    writer.save("best_genome", "best", 11)
+    writer.close()
+    (tmp_path/"checkpoint-3.tmp").write_bytes(b"")
+
+    writer = CheckpointWriter(tmp_path, history=2)
+    writer.save("checkpoint", 12, 12)
+    writer.close()
+    assert _history_generations(tmp_path, "checkpoint") == [11, 12]
+    # Other names and unfinished temporary files are left alone
+    assert _history_generations(tmp_path, "best_genome") == [11]
+    assert (tmp_path/"checkpoint-3.tmp").exists()
@@ -1,9 +1,8 @@
-import gzip
 import os
 import pathlib
-import pickle
 
 import neat
+from checkpoint_writer import load_checkpoint
 from curriculum_full import run_full
 from visualizer import TrainingVisualizer
 
@@ -16,9 +15,7 @@ def run_neat(config_file):
     
     
     best_genome_filepath = pathlib.Path()/"checkpoints"/"full"/"best_genome"
-    best_genome = None
-    with gzip.open(best_genome_filepath.absolute()) as f:
-        best_genome = pickle.load(f)
+    best_genome = load_checkpoint(best_genome_filepath.absolute())
     run_full(best_genome, config, config.visualizer)
 
 if __name__ == "__main__":
@@ -0,0 +1,71 @@
+"""
+Parity of the fused single-scene encoder with the reference Encoder, built
+from the trained encoder.pth. Run with python -m pytest from the repo root.
+"""
+import pytest
+import torch
+
+from encoder import Encoder
+from features import ASTEROID_DIM, MINERAL_DIM, SHIP_DIM
+from fused_encoder import FUSED_ATOL, INT8_ATOL, check_parity, export_fused_encoder, load_fused_encoder
+
+
+@pytest.fixture(scope="module")
+def encoder() -> Encoder:
+    torch.set_num_threads(1)
+    encoder = Encoder()
+    encoder.load_state_dict(torch.load("encoder.pth"))
+    return encoder.eval()
+
+
+@pytest.fixture(scope="module")
+def fused(encoder, tmp_path_factory):
+    path = tmp_path_factory.mktemp("fused")/"encoder_fused.pt"
+    export_fused_encoder("encoder.pth", str(path))
+    return load_fused_encoder(str(path))
+
+
+def _random_batch(batch_size: int, generator: torch.Generator):
+    """ A padded forward_batch batch of scenes with 0-8 asteroids and 0-5 minerals. """
+    num_asteroids = torch.randint(0, 9, (batch_size,), generator=generator)
+    num_minerals = torch.randint(0, 6, (batch_size,), generator=generator)
+    num_asteroids[0], num_minerals[0] = 8, 5
+    ship_data = torch.rand((batch_size, SHIP_DIM), generator=generator) * 2 - 1
+    asteroids_data = torch.rand((batch_size, 8, ASTEROID_DIM), generator=generator)
+    minerals_data = torch.rand((batch_size, 5, MINERAL_DIM), generator=generator)
+    return ship_data, asteroids_data, minerals_data, num_asteroids, num_minerals
+
+
+@torch.no_grad()
+def _max_batch_error(encoder: Encoder, fused, num_batches: int = 10, batch_size: int = 16) -> float:
+    """ Largest difference of fused, one scene at a time, from Encoder.forward_batch over the real rows. """
+    generator = torch.Generator().manual_seed(0)
+    max_error = 0.
+    for _ in range(num_batches):
+        ship_data, asteroids_data, minerals_data, num_asteroids, num_minerals = _random_batch(batch_size, generator)
+        obj_embeds, graph_embeds = encoder.forward_batch(ship_data, asteroids_data, minerals_data, num_asteroids, num_minerals)
+        max_asteroids = asteroids_data.shape[1]
+        for i in range(batch_size):
+            n_a, n_m = int(num_asteroids[i]), int(num_minerals[i])
+            fused_obj, fused_graph = fused(ship_data[i], asteroids_data[i, :n_a], minerals_data[i, :n_m])
+            rows = torch.cat((torch.arange(1 + n_a), 1 + max_asteroids + torch.arange(n_m)))
+            max_error = max(max_error,
+                            (obj_embeds[i, rows] - fused_obj).abs().max().item(),
+                            (graph_embeds[i] - fused_graph[0]).abs().max().item())
+    return max_error
+
+
+def test_fused_matches_encoder(encoder, fused):
+    assert check_parity(encoder, fused, atol=FUSED_ATOL) <= FUSED_ATOL
+
+
+def test_fused_matches_masked_batches(encoder, fused):
+    assert _max_batch_error(encoder, fused) <= FUSED_ATOL
+
+
+def test_int8_feed_forward_within_tolerance(encoder, tmp_path):
+    path = tmp_path/"encoder_fused_int8.pt"
+    export_fused_encoder("encoder.pth", str(path), quantize=True)
+    int8 = load_fused_encoder(str(path))
+    assert check_parity(encoder, int8, atol=INT8_ATOL) <= INT8_ATOL
+    assert _max_batch_error(encoder, int8) <= INT8_ATOL
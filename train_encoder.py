@@ -1,73 +1,160 @@
+import os
 import pathlib
-import json
+import random
 from typing import List, Dict, Tuple
-import math
 
+import numpy as np
 import torch
-from torch.utils.data import Dataset, DataLoader
+from torch.nn.utils.rnn import pad_sequence
+from torch.utils.data import Dataset, DataLoader, IterableDataset, get_worker_info
 
-from miner_objects import WIDTH, HEIGHT, DIAG
 from encoder import AutoEncoder
+from episode_store import SHIP_COLUMNS, EpisodeArrays, convert_json_dataset, episode_dirs, load_episode
+from features import ASTEROID_DIM, MINERAL_DIM, asteroid_features, mineral_features, ship_features
 
 
 class MinerDataset(Dataset):
-    def __init__(self):
-        dataset_dir = pathlib.Path("datasets")
-        self.data_list:List[Dict] = []
+    """
+    Every timestep of every recorded episode, normalised once at load time.
 
-        # Load all JSON episode files
-        for file in dataset_dir.glob("episode_*.json"):
-            with open(file, "r") as f:
-                episode_data = json.load(f)
-                self.data_list.extend(episode_data)
-        print(len(self.data_list))
+    Features are computed vectorised with the features module, so they follow
+    utils.generate_inputs column for column, and kept in three contiguous
+    tensors. Timestep i owns asteroid rows asteroid_offsets[i]:asteroid_offsets[i+1]
+    and likewise for minerals, which makes __getitem__ three slices.
+    """
+    def __init__(self, dataset_dir:pathlib.Path=pathlib.Path("datasets")):
+        # Episodes still recorded as JSON are converted once to the binary format
+        convert_json_dataset(dataset_dir)
+        episodes:List[EpisodeArrays] = [load_episode(directory) for directory in episode_dirs(dataset_dir)]
+        ship = np.concatenate([episode.ship for episode in episodes] + [np.zeros((0, len(SHIP_COLUMNS)), dtype=np.float32)])
+        asteroids = np.concatenate([episode.asteroids[episode.asteroid_offsets[0]:episode.asteroid_offsets[-1]] for episode in episodes]
+                                   + [np.zeros((0, ASTEROID_DIM), dtype=np.float32)])
+        minerals = np.concatenate([episode.minerals[episode.mineral_offsets[0]:episode.mineral_offsets[-1]] for episode in episodes]
+                                  + [np.zeros((0, MINERAL_DIM), dtype=np.float32)])
+        asteroid_counts = np.concatenate([np.diff(episode.asteroid_offsets) for episode in episodes] + [np.zeros((0,), dtype=np.int64)])
+        mineral_counts = np.concatenate([np.diff(episode.mineral_offsets) for episode in episodes] + [np.zeros((0,), dtype=np.int64)])
+
+        self.ship_data = torch.from_numpy(ship_features(*ship.T))
+        self.asteroids_data = torch.from_numpy(asteroid_features(*asteroids.T))
+        self.minerals_data = torch.from_numpy(mineral_features(*minerals.T))
+        self.asteroid_offsets = np.concatenate(([0], np.cumsum(asteroid_counts))).tolist()
+        self.mineral_offsets = np.concatenate(([0], np.cumsum(mineral_counts))).tolist()
+        print(len(self))
 
     def __getitem__(self, index):
-        data = self.data_list[index]
-        ship_raw_data = data["ship"]
-        ship_data = [ship_raw_data["x"]/WIDTH, ship_raw_data["y"]/HEIGHT, ship_raw_data["fuel"]/100, math.sin(ship_raw_data["angle"]), math.cos(ship_raw_data["angle"])]
-        ship_data = torch.as_tensor(ship_data, dtype=torch.float32)
-        asteroids_raw_data = data["asteroids"]
-        asteroids_data = []
-        for asteroid_raw_row in asteroids_raw_data:
-            ad = [asteroid_raw_row["x"]/WIDTH, asteroid_raw_row["y"]/HEIGHT,asteroid_raw_row["speed_x"]/WIDTH,asteroid_raw_row["speed_y"]/HEIGHT,asteroid_raw_row["radius"]/DIAG]
-            asteroids_data.append(ad)
-        asteroids_data = torch.as_tensor(asteroids_data, dtype=torch.float32)
-        minerals_raw_data = data["minerals"]
-        minerals_data = []
-        for mineral_raw_row in minerals_raw_data:
-            md = [mineral_raw_row["x"]/WIDTH, mineral_raw_row["y"]/HEIGHT]
-            minerals_data.append(md)
-        minerals_data = torch.as_tensor(minerals_data, dtype=torch.float32)
-        
+        ship_data = self.ship_data[index]
+        asteroids_data = self.asteroids_data[self.asteroid_offsets[index]:self.asteroid_offsets[index+1]]
+        minerals_data = self.minerals_data[self.mineral_offsets[index]:self.mineral_offsets[index+1]]
         return ship_data, asteroids_data, minerals_data
 
     def __len__(self):
-        return len(self.data_list)   
+        return len(self.ship_data)
+
+class EpisodeStream(IterableDataset):
+    """
+    Streaming counterpart of MinerDataset for datasets larger than RAM.
+
+    Episodes are split between the DataLoader workers, every worker
+    memory-maps and normalises one episode at a time and passes its scenes
+    through a shuffle buffer of shuffle_buffer_size scenes, so memory use is
+    bounded by the buffer rather than by the dataset. Episode order and
+    buffer draws are reshuffled on every pass over the data.
+    """
+    def __init__(self,
+                 dataset_dir:pathlib.Path=pathlib.Path("datasets"),
+                 shuffle_buffer_size:int=4096,
+                 seed:int=0):
+        # Convert in the main process, before workers start reading
+        convert_json_dataset(dataset_dir)
+        self.episode_dirs = episode_dirs(dataset_dir)
+        self.shuffle_buffer_size = shuffle_buffer_size
+        self.seed = seed
+        # Every worker keeps its own copy of the dataset, and all of them count the same passes
+        self.num_passes = 0
+
+    def _episode_scenes(self, directory:pathlib.Path):
+        episode = load_episode(directory)
+        ship_data = torch.from_numpy(ship_features(*episode.ship.T))
+        asteroids_data = torch.from_numpy(asteroid_features(*episode.asteroids.T))
+        minerals_data = torch.from_numpy(mineral_features(*episode.minerals.T))
+        asteroid_offsets = episode.asteroid_offsets.tolist()
+        mineral_offsets = episode.mineral_offsets.tolist()
+        for t in range(len(episode)):
+            yield (ship_data[t],
+                   asteroids_data[asteroid_offsets[t]:asteroid_offsets[t+1]],
+                   minerals_data[mineral_offsets[t]:mineral_offsets[t+1]])
+
+    def __iter__(self):
+        worker_info = get_worker_info()
+        worker_id, num_workers = (0, 1) if worker_info is None else (worker_info.id, worker_info.num_workers)
+        # Same episode order in every worker so the shards are disjoint
+        episode_order = list(self.episode_dirs)
+        random.Random(self.seed + self.num_passes).shuffle(episode_order)
+        rng = random.Random(self.seed + self.num_passes*num_workers + worker_id + 1)
+        self.num_passes += 1
+
+        buffer = []
+        for directory in episode_order[worker_id::num_workers]:
+            for scene in self._episode_scenes(directory):
+                if len(buffer) < self.shuffle_buffer_size:
+                    buffer.append(scene)
+                    continue
+                i = rng.randrange(len(buffer))
+                yield buffer[i]
+                buffer[i] = scene
+        rng.shuffle(buffer)
+        yield from buffer
 
 def collate_fn(batch):
-    return batch
+    """ Pad a list of scenes into (B, 5), (B, max_asteroids, 5) and (B, max_minerals, 2) tensors plus row counts. """
+    ship_data, asteroids_data, minerals_data = zip(*batch)
+    num_asteroids = torch.as_tensor([len(asteroids) for asteroids in asteroids_data])
+    num_minerals = torch.as_tensor([len(minerals) for minerals in minerals_data])
+    return (torch.stack(ship_data),
+            pad_sequence(asteroids_data, batch_first=True),
+            pad_sequence(minerals_data, batch_first=True),
+            num_asteroids,
+            num_minerals)
+
+def masked_mse(preds:Tuple[torch.Tensor,torch.Tensor,torch.Tensor],
+               targets:Tuple[torch.Tensor,torch.Tensor,torch.Tensor],
+               num_asteroids:torch.Tensor,
+               num_minerals:torch.Tensor)->torch.Tensor:
+    """
+    Mean squared error of every scene over its real rows only, averaged over
+    the batch, i.e. the mean of the per-scene losses of the unpadded scenes.
+    """
+    ship_pred, asteroids_pred, minerals_pred = preds
+    ship_data, asteroids_data, minerals_data = targets
+    asteroids_valid = (torch.arange(asteroids_data.shape[1])[None, :] < num_asteroids[:, None]).to(asteroids_data.dtype)
+    minerals_valid = (torch.arange(minerals_data.shape[1])[None, :] < num_minerals[:, None]).to(minerals_data.dtype)
+    squared_error = ((ship_pred - ship_data)**2).sum(dim=1)
+    squared_error = squared_error + (((asteroids_pred - asteroids_data)**2).sum(dim=2) * asteroids_valid).sum(dim=1)
+    squared_error = squared_error + (((minerals_pred - minerals_data)**2).sum(dim=2) * minerals_valid).sum(dim=1)
+    num_elements = ship_data.shape[1] + num_asteroids * asteroids_data.shape[2] + num_minerals * minerals_data.shape[2]
+    return (squared_error / num_elements).mean()
 
 if __name__ == "__main__":
-    dataset = MinerDataset()
+    dataset = EpisodeStream()
     auto_encoder = AutoEncoder()
     optimizer = torch.optim.Adam(auto_encoder.parameters(), lr=3e-4)
-    dataloader = DataLoader(dataset, batch_size=32, shuffle=True, collate_fn=collate_fn)
-    loss_func = torch.nn.MSELoss()
+    # Workers read and shuffle episodes while the trainer runs, their batches
+    # come back through shared memory with prefetch_factor batches in flight each
+    num_workers = max(1, min(4, (os.cpu_count() or 2) - 1))
+    dataloader = DataLoader(dataset,
+                            batch_size=32,
+                            collate_fn=collate_fn,
+                            num_workers=num_workers,
+                            pin_memory=torch.cuda.is_available(),
+                            prefetch_factor=4,
+                            persistent_workers=True)
     num_epochs = 50
     for epoch in range(num_epochs):
         epoch_loss = []
-        for batch in dataloader:
-            total_loss = 0
-            for bi, bdata in enumerate(batch):
-                ship_data, asteroids_data, minerals_data = bdata
-                ship_data_pred, asteroids_data_pred, minerals_data_pred = auto_encoder(ship_data, asteroids_data, minerals_data)
-                bdata_orig = torch.cat((ship_data.ravel(),asteroids_data.ravel(),minerals_data.ravel()))
-                pred_data = torch.cat((ship_data_pred.ravel(),asteroids_data_pred.ravel(),minerals_data_pred.ravel()))
-                loss = loss_func(bdata_orig, pred_data)
-                total_loss += loss
+        for ship_data, asteroids_data, minerals_data, num_asteroids, num_minerals in dataloader:
+            preds = auto_encoder.forward_batch(ship_data, asteroids_data, minerals_data, num_asteroids, num_minerals)
+            total_loss = masked_mse(preds, (ship_data, asteroids_data, minerals_data), num_asteroids, num_minerals)
             optimizer.zero_grad()
-            total_loss /= len(batch)
             total_loss.backward()
             epoch_loss.append(total_loss.item())
             optimizer.step()
@@ -76,4 +163,3 @@ if __name__ == "__main__":
         if epoch_loss < 5e-4:
             break
     torch.save(auto_encoder.encoder.state_dict(),"encoder.pth")
-        
\ No newline at end of file
@@ -1,17 +1,19 @@
 ﻿import os
 import pathlib
-from functools import partial
+import sys
 from typing import Callable, List
 
 import neat
-import pygame
+from batch_evaluator import BatchEvaluator
+from checkpoint_writer import CheckpointWriter
 from curriculum_full import run_full
-from custom_reporter import NewBestReport
-from neat.parallel import ParallelEvaluator
-from utils import eval_function_template
+from custom_reporter import MetricsReport, NewBestReport, ProfileReport
+from evaluation_config import EvaluationConfig
+from fitness_cache import CachedEvaluator, FitnessCache
+from metrics import MetricsSink
+from scenario_seeds import ScenarioSeeds
 from visualizer import TrainingVisualizer
-
-from encoder import Encoder
+from worker_pool import PersistentEvaluator
 
 
 def run_neat(config_file):    
@@ -27,17 +29,52 @@ def run_neat(config_file):
     population.add_reporter(neat.StdOutReporter(True))
     stats = neat.StatisticsReporter()
     population.add_reporter(stats)
+    evaluation_config = EvaluationConfig(config_file)
+    # Cached fitness is only valid for the common seeds it was scored on
+    fitness_cache = None
+    if evaluation_config.common_seeds and evaluation_config.fitness_cache_size > 0:
+        fitness_cache = FitnessCache(evaluation_config.fitness_cache_size)
     checkpoint_dir = pathlib.Path()/"checkpoints"/"full"
     log_dir = pathlib.Path()/"logs"/"full"
-    population.add_reporter(NewBestReport(checkpoint_dir, log_dir))
+    # Checkpoints are compressed and written in the background, keeping the last 5 of each
+    checkpoint_writer = CheckpointWriter(checkpoint_dir, codec="gzip", history=5)
+    # One buffered TensorBoard writer for every reporter
+    metrics = MetricsSink(log_dir)
+    population.add_reporter(NewBestReport(checkpoint_dir, log_dir, fitness_cache, checkpoint_writer, metrics))
     # population.add_reporter(neat.Checkpointer(generation_interval=10))
-    eval_function = partial(eval_function_template, run_full)
-    evaluator = ParallelEvaluator(8, eval_function)
+    scenario_seeds = None
+    if evaluation_config.common_seeds:
+        scenario_seeds = ScenarioSeeds(evaluation_config.num_samples,
+                                       evaluation_config.scenario_seed,
+                                       evaluation_config.seed_refresh_interval)
+    if evaluation_config.evaluator == "batch":
+        evaluator = BatchEvaluator(evaluation_config.num_samples,
+                                   scenario_seeds=scenario_seeds,
+                                   profile=evaluation_config.profile)
+    else:
+        evaluator = PersistentEvaluator(evaluation_config.num_workers,
+                                        run_full,
+                                        evaluation_config.num_samples,
+                                        embedding_cache_size=evaluation_config.embedding_cache_size,
+                                        embedding_cache_tolerance=evaluation_config.embedding_cache_tolerance,
+                                        encoder_backend=evaluation_config.encoder_backend,
+                                        scenario_seeds=scenario_seeds,
+                                        profile=evaluation_config.profile)
+    if fitness_cache is not None:
+        evaluator = CachedEvaluator(evaluator, fitness_cache, scenario_seeds)
+    population.add_reporter(MetricsReport(metrics, evaluator))
+    if evaluation_config.profile:
+        population.add_reporter(ProfileReport(evaluator))
     # Run NEAT
     try:
         winner = population.run(evaluator.evaluate, 10000)
     finally:
-        pygame.quit()
+        evaluator.close()
+        checkpoint_writer.close()
+        metrics.close()
+        # pygame is only loaded if the visualizer rendered an episode
+        if "pygame" in sys.modules:
+            sys.modules["pygame"].quit()
 
 if __name__ == "__main__":
     
@@ -1,17 +1,65 @@
+from __future__ import annotations
+
+import importlib
 import math
-from typing import List, Optional, Tuple, Union
+import random
+from typing import TYPE_CHECKING, List, Optional, Sequence, Tuple, Union
 
-import neat
-import numba as nb
 import numpy as np
-import pygame
 from miner_objects import (DIAG, HEIGHT, RED, WHITE, WIDTH, YELLOW, Asteroid,
                            Mineral, Spaceship)
-from pygame.surface import Surface
-from encoder import Encoder
-import torch
-
-def setup_encoder()->Encoder:
+from spatial_hash import SpatialHash
+
+if TYPE_CHECKING:
+    # torch, pygame, neat and the numba ray casting kernels are only imported
+    # where they are used, so headless workers never load what they don't need
+    import neat
+    import torch
+    from encoder import Encoder
+    from numpy_encoder import NumpyEncoder
+    from pygame.surface import Surface
+    from raycast import (RaySensor, cast_rays_batch_nb, cast_rays_nb,
+                         ray_circle_intersect)
+
+# Names still importable from utils, loaded from their module on first access
+_LAZY_ATTRIBUTES = {
+    "RaySensor": "raycast",
+    "cast_rays_batch_nb": "raycast",
+    "cast_rays_nb": "raycast",
+    "ray_circle_intersect": "raycast",
+}
+
+
+def __getattr__(name: str):
+    if name in _LAZY_ATTRIBUTES:
+        value = getattr(importlib.import_module(_LAZY_ATTRIBUTES[name]), name)
+        globals()[name] = value
+        return value
+    raise AttributeError("module {0!r} has no attribute {1!r}".format(__name__, name))
+
+ENCODER_BACKENDS = ("torch", "numpy", "fused")
+
+def setup_encoder(backend:str="torch")->Union["Encoder", "NumpyEncoder", "torch.jit.ScriptModule"]:
+    """
+    Load the trained encoder for the given backend: "torch" loads encoder.pth
+    into an Encoder, "numpy" loads encoder.npz (see numpy_encoder.export_npz)
+    into a NumpyEncoder, and "fused" loads the scripted single-scene
+    FusedEncoder from encoder_fused.pt. The numpy and fused files are
+    exported from encoder.pth first when they are missing or older; with
+    an up to date encoder.npz, the numpy backend never imports torch.
+    """
+    if backend == "fused":
+        from fused_encoder import export_fused_encoder_if_stale, load_fused_encoder
+        export_fused_encoder_if_stale("encoder.pth", "encoder_fused.pt")
+        return load_fused_encoder("encoder_fused.pt")
+    if backend == "numpy":
+        from numpy_encoder import NumpyEncoder, export_npz_if_stale
+        export_npz_if_stale("encoder.pth", "encoder.npz")
+        return NumpyEncoder("encoder.npz")
+    if backend != "torch":
+        raise ValueError("Unknown encoder backend: {0}".format(backend))
+    import torch
+    from encoder import Encoder
     encoder = Encoder()
     encoder_state_dict = torch.load("encoder.pth")
     encoder.load_state_dict(encoder_state_dict)
@@ -20,51 +68,36 @@ def setup_encoder()->Encoder:
 
 
 
-def eval_function_template(simulation_evaluation, genome: neat.DefaultGenome, config: neat.config, num_samples:int=3):
+def eval_function_template(simulation_evaluation,
+                           genome: neat.DefaultGenome,
+                           config: neat.config,
+                           num_samples:int=3,
+                           seeds:Optional[Sequence[int]]=None):
+    """
+    Mean of num_samples episodes. With seeds, one episode is played per seed
+    as simulation_evaluation(genome, config, seed=seed), so genomes scored on
+    the same seeds face the same scenarios.
+    """
+    if seeds is not None:
+        return sum(simulation_evaluation(genome, config, seed=seed) for seed in seeds)/len(seeds)
     total_fitness = 0
     for n in range(num_samples):
         total_fitness += simulation_evaluation(genome, config) 
     avg_fitness = total_fitness/num_samples
     return avg_fitness
 
-@nb.njit(nb.float64(nb.float64,nb.float64,nb.float64,nb.float64,nb.float64,nb.float64,nb.float64))
-def ray_circle_intersect(ox:float,
-                         oy:float,
-                         dx:float,
-                         dy:float,
-                         cx:float,
-                         cy:float,
-                         r:float)->float:
-    # 1. Compute quadratic coefficients
-    fx = ox - cx
-    fy = oy - cy
-    a = 1  # dx*dx + dy*dy, assuming (dx,dy) normalized
-    b = 2 * (fx * dx + fy * dy)
-    c = fx*fx + fy*fy - r*r
-
-    # 2. Discriminant
-    disc = b*b - 4*a*c
-    if disc < 0:
-        return -9999.0   # no intersection
-
-    # 3. Two possible solutions
-    sqrt_disc = math.sqrt(disc)
-    t1 = (-b - sqrt_disc) / (2*a)
-    t2 = (-b + sqrt_disc) / (2*a)
-
-    # 4. Choose nearest forward hit
-    t = -9999.0
-    for t_candidate in (t1, t2):
-        if t_candidate >= 0:
-            if t < 999 or t_candidate < t:
-                t = t_candidate
-
-    return t  # may remain None if both < 0
-
 def cast_ray(ox:float,
              oy:float,
              angle:float,
-             objects:List[Union[Mineral, Asteroid]])->Tuple[float, int]:
+             objects:List[Union[Mineral, Asteroid]],
+             index:Optional[SpatialHash]=None)->Tuple[float, int]:
+    if index is not None:
+        # objects are the keys of index, walk the grid instead of every object
+        obj, closest_t = index.cast_ray(ox, oy, angle, DIAG)
+        if obj is None:
+            return 1.0, 0
+        return min(1.0, closest_t / DIAG), +1 if isinstance(obj, Mineral) else -1
+    from raycast import ray_circle_intersect
     dx, dy = math.cos(angle), math.sin(angle)
     closest_t = None
     closest_flag = 0
@@ -84,7 +117,7 @@ def cast_ray(ox:float,
     return norm_dist, closest_flag
 
 
-def apply_action(ship:Spaceship, output, minerals)->int:
+def apply_action(ship:Spaceship, output, minerals, mineral_index:Optional[SpatialHash]=None)->int:
     ship.angle += (output[0] * 2 - 1) * 0.1  # Turn (-1 to 1)
     dx, dy = 0,0
     if output[1] > 0.5:  # Thrust
@@ -93,11 +126,14 @@ def apply_action(ship:Spaceship, output, minerals)->int:
     ship.move(dx, dy)
     # num_minerals_mined: int = 0
     # if output[2] > 0.5:  # Mine
-    num_minerals_mined = ship.mine(minerals)
+    num_minerals_mined = ship.mine(minerals, mineral_index)
     return num_minerals_mined
 
-def generate_static_steroids(num_asteroids:int=5, mode:str="horizontal", screen:Optional[Surface]=None)->List[Asteroid]:
-    asteroids: List[Asteroid] = [Asteroid(screen) for _ in range(5)]
+def generate_static_steroids(num_asteroids:int=5,
+                             mode:str="horizontal",
+                             screen:Optional[Surface]=None,
+                             rng:Optional[random.Random]=None)->List[Asteroid]:
+    asteroids: List[Asteroid] = [Asteroid(screen, rng) for _ in range(5)]
     for ai, asteroid in enumerate(asteroids):
         asteroid.speed_x = 0
         asteroid.speed_y = 0
@@ -110,8 +146,12 @@ def generate_static_steroids(num_asteroids:int=5, mode:str="horizontal", screen:
             asteroid.y = HEIGHT/(num_asteroids+1) * (ai+1.5)
     return asteroids
 
-def generate_linear_minerals(ship_x:int, ship_y:int, num_minerals:int=5, screen:Optional[Surface]=None)->List[Mineral]:
-    seed_mineral = Mineral(screen)
+def generate_linear_minerals(ship_x:int,
+                             ship_y:int,
+                             num_minerals:int=5,
+                             screen:Optional[Surface]=None,
+                             rng:Optional[random.Random]=None)->List[Mineral]:
+    seed_mineral = Mineral(screen, rng)
     # Vector from ship to seed mineral
     dx = seed_mineral.x - ship_x
     dy = seed_mineral.y - ship_y
@@ -121,7 +161,7 @@ def generate_linear_minerals(ship_x:int, ship_y:int, num_minerals:int=5, screen:
         t = i / (num_minerals - 1)  # Evenly spaced [0, 1]
         x = ship_x + t * dx
         y = ship_y + t * dy
-        m = Mineral(screen)
+        m = Mineral(screen, rng)
         m.x = x
         m.y = y
         minerals.append(m)
@@ -129,59 +169,18 @@ def generate_linear_minerals(ship_x:int, ship_y:int, num_minerals:int=5, screen:
     return minerals
 
 
-def cast_rays_nb(ship_x: float, 
-                 ship_y: float, 
-                 ship_angle: float,
-                 num_rays:int, 
-                 object_coords:np.ndarray, 
-                 obj_radius: np.ndarray, 
-                 obj_flags: np.ndarray,
-                 max_length:float,
-                 dist_flag_arr:np.ndarray)->np.ndarray:
-    angles = ship_angle + np.arange(num_rays) * (math.pi/(num_rays/2))
-    dxs, dys = np.cos(angles), np.sin(angles)
-    
-    num_objs = obj_radius.shape[0]
-
-    for ri in range(num_rays):
-        closest_t = -9999
-        closest_flag = 0
-        for i in range(num_objs):  # mix of minerals & asteroids
-            t = ray_circle_intersect(ship_x, ship_y, dxs[ri], dys[ri], object_coords[i,0], object_coords[i,1], obj_radius[i])
-            if t < -999:
-                continue
-            if closest_t is None or t < closest_t:
-                closest_t = t
-                closest_flag = obj_flags[i]
-
-        if closest_t < -999:
-            closest_t = 99999.
-            closest_flag = 0
-            # no hit
-        # normalize
-        norm_dist = min(1.0, closest_t / max_length)
-        dist_flag_arr[ri*2] = norm_dist
-        dist_flag_arr[ri*2+1] = closest_flag
-        
-    return dist_flag_arr
-
 def cast_ray_nb_caller(ship_x:float, ship_y:float, ship_angle:float, num_rays:int, objects:List[Union[Mineral, Asteroid]])->np.ndarray:
-    dist_flag_arr = np.empty((num_rays*2,), dtype=float)
-    object_coords = np.asanyarray([[obj.x, obj.y] for obj in objects], dtype=float)
-    obj_radius = np.asanyarray([obj.radius for obj in objects], dtype=float)
-    obj_flags = []
-    for obj in objects:
-        if isinstance(obj, Mineral):
-            obj_flags.append(1.)
-        else:
-            obj_flags.append(-1.)
-    obj_flags = np.asanyarray(obj_flags)
-    dist_flag_arr = cast_rays_nb(ship_x, ship_y, ship_angle, num_rays, object_coords, obj_radius, obj_flags, DIAG, dist_flag_arr)    
-    return dist_flag_arr.tolist()
+    # One-off convenience wrapper, keep a RaySensor around to cast every tick without allocating
+    from raycast import RaySensor
+    sensor = RaySensor(num_rays, len(objects))
+    sensor.set_objects(0, objects)
+    dist_flag_arr = sensor.cast(np.asarray([ship_x]), np.asarray([ship_y]), np.asarray([ship_angle]))
+    return dist_flag_arr[0].tolist()
 
 def generate_inputs(ship: Spaceship, 
                     minerals: List[Mineral], 
-                    asteroids: List[Asteroid])->Tuple[torch.Tensor,torch.Tensor,torch.Tensor]:
+                    asteroids: List[Asteroid])->Tuple["torch.Tensor","torch.Tensor","torch.Tensor"]:
+    import torch
     ship_data = [ship.x/WIDTH, ship.y/HEIGHT, ship.fuel/100, math.sin(ship.angle), math.cos(ship.angle)]
     ship_data = torch.as_tensor(ship_data, dtype=torch.float32)
     asteroids_data = []
@@ -5,8 +5,6 @@ import time
 from typing import Callable, List, Optional, Tuple, Union
 
 import neat
-import numba as nb
-import pygame
 from miner_objects import WHITE
 
 
@@ -30,6 +28,8 @@ class TrainingVisualizer:
         print(f"Generation {self.generation} best: {best_genome.fitness:.1f}")
 
     def draw_stats(self, screen, fitness, minerals, ship):
+        # Only called while rendering, so headless runs never import pygame
+        import pygame
         stats = [
             f"Gen: {self.generation}"
             f"Ship Position {ship.x:.1f},{ship.y:.1f}",
@@ -0,0 +1,156 @@
+import time
+from functools import partial
+from multiprocessing import Pool
+from typing import Callable, Dict, List, Optional, Tuple
+
+import neat
+
+from scenario_seeds import ScenarioSeeds
+
+# Per-process state, filled once by _init_worker
+_worker_state: Dict = {}
+
+
+def _init_worker(config: neat.Config,
+                 simulation_evaluation: Callable,
+                 num_samples: int,
+                 num_threads: int,
+                 embedding_cache_size: int,
+                 embedding_cache_tolerance: float,
+                 encoder_backend: str,
+                 profile: bool):
+    init_start = time.perf_counter()
+    # Workers run run_full headless, so pygame is never imported or initialised here
+    from embedding_cache import EmbeddingCache
+    from utils import setup_encoder
+
+    if encoder_backend != "numpy":
+        import torch
+        torch.set_num_threads(num_threads)
+        torch.set_num_interop_threads(num_threads)
+    encoder = setup_encoder(encoder_backend)
+    encoder.eval()
+    if embedding_cache_size > 0:
+        encoder = EmbeddingCache(encoder, embedding_cache_size, embedding_cache_tolerance)
+    _worker_state.update(config=config,
+                         simulation_evaluation=simulation_evaluation,
+                         num_samples=num_samples,
+                         encoder=encoder,
+                         profile=profile,
+                         init_time=time.perf_counter() - init_start)
+
+
+def _evaluate_genome(job: Tuple[int, neat.DefaultGenome, Optional[Tuple[int, ...]]]) -> Tuple[int, float, Dict[str, float]]:
+    from utils import eval_function_template
+
+    genome_id, genome, seeds = job
+    timings = {"setup": 0., "simulation": 0.}
+    # Report the one-off start-up cost with the first genome this worker evaluates
+    timings["worker_init"] = _worker_state.pop("init_time", 0.)
+    encoder = _worker_state["encoder"]
+    hits, misses = getattr(encoder, "hits", 0), getattr(encoder, "misses", 0)
+    simulation_evaluation = partial(_worker_state["simulation_evaluation"],
+                                    encoder=encoder,
+                                    timings=timings)
+    if _worker_state["profile"]:
+        simulation_evaluation = partial(simulation_evaluation, profile=True)
+    fitness = eval_function_template(simulation_evaluation,
+                                     genome,
+                                     _worker_state["config"],
+                                     _worker_state["num_samples"],
+                                     seeds)
+    timings["cache_hits"] = getattr(encoder, "hits", 0) - hits
+    timings["cache_misses"] = getattr(encoder, "misses", 0) - misses
+    return genome_id, fitness, timings
+
+
+class PersistentEvaluator:
+    """
+    Drop-in replacement for neat.parallel.ParallelEvaluator whose worker
+    processes live for the whole run. Each worker
+    loads the encoder with encoder_backend ("torch", "numpy" or "fused") and sets its
+    torch thread counts once; genomes are then streamed to the workers as
+    they free up.
+
+    simulation_evaluation is called as
+    simulation_evaluation(genome, config, encoder=..., timings=...), like run_full.
+    With embedding_cache_size > 0 each worker's encoder sits behind an
+    EmbeddingCache that lives as long as the worker.
+    With scenario_seeds, every genome plays that generation's common seeds
+    (passed on as simulation_evaluation(..., seed=...)) and genomes already
+    scored on them are skipped.
+    With profile, episodes run with simulation_evaluation(..., profile=True)
+    and the per-phase times of every worker are summed per generation.
+    The time split of every evaluate call is kept in generation_timings.
+    """
+    def __init__(self,
+                 num_workers: int,
+                 simulation_evaluation: Callable,
+                 num_samples: int = 3,
+                 num_threads: int = 1,
+                 timeout: Optional[float] = None,
+                 embedding_cache_size: int = 0,
+                 embedding_cache_tolerance: float = 0.,
+                 encoder_backend: str = "torch",
+                 scenario_seeds: Optional[ScenarioSeeds] = None,
+                 profile: bool = False):
+        self.num_workers = num_workers
+        self.simulation_evaluation = simulation_evaluation
+        self.num_samples = num_samples
+        self.num_threads = num_threads
+        self.timeout = timeout
+        self.embedding_cache_size = embedding_cache_size
+        self.embedding_cache_tolerance = embedding_cache_tolerance
+        self.encoder_backend = encoder_backend
+        self.scenario_seeds = scenario_seeds
+        self.profile = profile
+        self.pool = None
+        self.generation_timings: List[Dict[str, float]] = []
+
+    def _start(self, config: neat.Config):
+        # Convert once here rather than in every worker
+        if self.encoder_backend == "numpy":
+            from numpy_encoder import export_npz_if_stale
+            export_npz_if_stale()
+        elif self.encoder_backend == "fused":
+            from fused_encoder import export_fused_encoder_if_stale
+            export_fused_encoder_if_stale()
+        self.pool = Pool(self.num_workers,
+                         initializer=_init_worker,
+                         initargs=(config, self.simulation_evaluation, self.num_samples, self.num_threads,
+                                   self.embedding_cache_size, self.embedding_cache_tolerance,
+                                   self.encoder_backend, self.profile))
+
+    def evaluate(self, genomes: List[Tuple[int, neat.DefaultGenome]], config: neat.Config):
+        if self.pool is None:
+            self._start(config)
+        start = time.perf_counter()
+        common_seeds = self.scenario_seeds.next_generation() if self.scenario_seeds is not None else None
+        jobs = [(genome_id, genome, common_seeds) for genome_id, genome in genomes
+                if not ScenarioSeeds.already_evaluated(genome, common_seeds)]
+        genomes_by_id = dict(genomes)
+        timings = {"setup": 0., "simulation": 0., "worker_init": 0., "cache_hits": 0, "cache_misses": 0,
+                   "episodes": 0, "ticks": 0, "skipped": len(genomes) - len(jobs)}
+        results = self.pool.imap_unordered(_evaluate_genome, jobs)
+        for _ in range(len(jobs)):
+            genome_id, fitness, genome_timings = results.next(timeout=self.timeout)
+            genomes_by_id[genome_id].fitness = fitness
+            ScenarioSeeds.mark_evaluated(genomes_by_id[genome_id], common_seeds)
+            for key, value in genome_timings.items():
+                timings[key] = timings.get(key, 0) + value
+        timings["wall"] = time.perf_counter() - start
+        self.generation_timings.append(timings)
+        print("Evaluated {0} genomes in {1:.2f}s: setup {2:.2f}s, simulation {3:.2f}s, worker start-up {4:.2f}s (summed over workers)".format(
+            len(jobs), timings["wall"], timings["setup"], timings["simulation"], timings["worker_init"]))
+        if timings["skipped"] > 0:
+            print("Skipped {0} genomes already scored on these seeds".format(timings["skipped"]))
+        lookups = timings["cache_hits"] + timings["cache_misses"]
+        if lookups > 0:
+            print("Embedding cache: {0} hits, {1} misses ({2:.1%} hit rate)".format(
+                timings["cache_hits"], timings["cache_misses"], timings["cache_hits"] / lookups))
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None